@@ -18,3 +18,24 @@ class SentenceType(Enum):
     INTERROGATIVE = 'interrogative'
     EXCLAMATORY = 'exclamatory'
     IMPERATIVE = 'imperative'
+
+
+class NGramKind(Enum):
+    CONTEXT = 'context'
+    TYPE = 'type'
+
+
+class MatchingMode(Enum):
+    BIT_PARALLEL = 'bit_parallel'
+    LENGTH_BUCKETS = 'length_buckets'
+
+
+class GenerationBackend(Enum):
+    NUMPY = 'numpy'
+    TENSORFLOW = 'tensorflow'
+
+
+class WeightPrecision(Enum):
+    FLOAT32 = 'float32'
+    FLOAT16 = 'float16'
+    INT8 = 'int8'
@@ -0,0 +1,123 @@
+import json
+import time
+
+
+# Returned by next() once an iterator is exhausted
+_EXHAUSTED = object()
+
+
+class StageTimer:
+    # Exclusive wall time and item counts per stage, entering a stage pauses the stage around it
+    def __init__(self):
+        self.seconds = dict()
+        self.items = dict()
+        self._stack = []
+        self._mark = None
+
+    # Charge time since the last switch to the innermost open stage
+    def _switch(self):
+        now = time.perf_counter()
+        if self._stack:
+            self.seconds[self._stack[-1]] = self.seconds.get(self._stack[-1], 0) + now - self._mark
+        self._mark = now
+
+    def enter(self, name):
+        self._switch()
+        self._stack.append(name)
+
+    def exit(self):
+        self._switch()
+        self._stack.pop()
+
+    def count(self, name, items=1):
+        self.items[name] = self.items.get(name, 0) + items
+
+    # Call function as one item of a stage
+    def call(self, name, function, *args):
+        self.enter(name)
+        try:
+            return function(*args)
+        finally:
+            self.exit()
+            self.count(name)
+
+    # Yield from iterable, timing the production of each item as a stage
+    def iterate(self, name, iterable):
+        iterator = iter(iterable)
+        while True:
+            self.enter(name)
+            try:
+                item = next(iterator, _EXHAUSTED)
+            finally:
+                self.exit()
+            if item is _EXHAUSTED:
+                return
+            self.count(name)
+            yield item
+
+    # Add times and counts recorded by another timer
+    def merge(self, other):
+        for name, seconds in other.seconds.items():
+            self.seconds[name] = self.seconds.get(name, 0) + seconds
+        for name, items in other.items.items():
+            self.count(name, items)
+
+    def as_dict(self):
+        return {
+            name: {
+                'seconds': round(seconds, 6),
+                'items': self.items.get(name, 0),
+                'items_per_second': _rate(self.items.get(name, 0), seconds),
+            }
+            for name, seconds in sorted(self.seconds.items())
+        }
+
+
+class IngestionReport:
+    # Stage timings, per script throughput and database rows written during one ingestion run
+    def __init__(self, workers):
+        self.workers = workers
+        self.timer = StageTimer()
+        self.scripts = []
+        self.rows = dict()
+        self._started = time.perf_counter()
+
+    # Record a parsed script, folding its stage timings into the run totals
+    def add_script(self, result):
+        self.timer.merge(result.timer)
+        self.scripts.append({
+            'genre': result.genre.value,
+            'file_name': result.file_name,
+            'seconds': round(result.seconds, 6),
+            'sentences': result.total,
+            'kept_sentences': len(result.sentences),
+            'sentences_per_second': _rate(result.total, result.seconds),
+        })
+
+    def count_rows(self, table, rows):
+        self.rows[table] = self.rows.get(table, 0) + rows
+
+    def summary(self):
+        wall_seconds = time.perf_counter() - self._started
+        sentences = sum(script['sentences'] for script in self.scripts)
+        return {
+            'workers': self.workers,
+            'wall_seconds': round(wall_seconds, 6),
+            'scripts': len(self.scripts),
+            'sentences': sentences,
+            'sentences_per_second': _rate(sentences, wall_seconds),
+            'stages': self.timer.as_dict(),
+            'database_rows': dict(sorted(self.rows.items())),
+            'per_script': self.scripts,
+        }
+
+    def write(self, path):
+        summary = self.summary()
+        with open(path, 'w') as f:
+            json.dump(summary, f, indent=2)
+        return summary
+
+
+# Items per second, unless no time was recorded
+def _rate(items, seconds):
+    return round(items / seconds, 3) if seconds else None
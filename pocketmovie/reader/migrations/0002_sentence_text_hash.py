@@ -0,0 +1,49 @@
+import hashlib
+
+from django.db import migrations, models
+
+
+# Frozen copy of Sentence.content_hash as it stood when text hashes were introduced
+def content_hash(text, genre, sentence_context, sentence_type):
+    content = '\x1f'.join([str(genre), str(sentence_context), str(sentence_type), text])
+    return hashlib.sha256(content.encode('utf-8')).hexdigest()
+
+
+# Hash existing sentences, removing rows that duplicate an earlier one
+def populate_text_hashes(apps, schema_editor):
+    Sentence = apps.get_model('reader', 'Sentence')
+    seen = set()
+    for sentence in Sentence.objects.order_by('id').iterator():
+        text_hash = content_hash(
+            sentence.text,
+            sentence.genre,
+            sentence.sentence_context,
+            sentence.sentence_type
+        )
+        if text_hash in seen:
+            sentence.delete()
+        else:
+            seen.add(text_hash)
+            sentence.text_hash = text_hash
+            sentence.save(update_fields=['text_hash'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('reader', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='sentence',
+            name='text_hash',
+            field=models.CharField(editable=False, max_length=64, null=True),
+        ),
+        migrations.RunPython(populate_text_hashes, migrations.RunPython.noop),
+        migrations.AlterField(
+            model_name='sentence',
+            name='text_hash',
+            field=models.CharField(editable=False, max_length=64, unique=True),
+        ),
+    ]
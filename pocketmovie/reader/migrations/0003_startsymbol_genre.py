@@ -0,0 +1,24 @@
+from django.db import migrations, models
+import pocketmovie.enums
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('reader', '0002_sentence_text_hash'),
+    ]
+
+    operations = [
+        # Counts gathered before start symbols were scoped by genre cannot be attributed to one
+        migrations.RunSQL('DELETE FROM reader_startsymbol', migrations.RunSQL.noop),
+        migrations.AddField(
+            model_name='startsymbol',
+            name='genre',
+            field=models.CharField(choices=[(pocketmovie.enums.Genre('action'), 'action'), (pocketmovie.enums.Genre('romance'), 'romance'), (pocketmovie.enums.Genre('horror'), 'horror')], default='', max_length=20),
+            preserve_default=False,
+        ),
+        migrations.AlterUniqueTogether(
+            name='startsymbol',
+            unique_together={('genre', 'sentence_context', 'sentence_type')},
+        ),
+    ]
@@ -0,0 +1,43 @@
+# Generated by Django 2.2.8 on 2026-10-18 12:32
+
+from django.db import migrations, models
+import pocketmovie.enums
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('reader', '0003_startsymbol_genre'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ScriptManifest',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('genre', models.CharField(choices=[(pocketmovie.enums.Genre('action'), 'action'), (pocketmovie.enums.Genre('romance'), 'romance'), (pocketmovie.enums.Genre('horror'), 'horror')], max_length=20)),
+                ('file_name', models.CharField(max_length=200)),
+                ('content_hash', models.CharField(max_length=64)),
+                ('sentence_total', models.IntegerField(default=0)),
+                ('counts', models.TextField(default='{}')),
+            ],
+            options={
+                'unique_together': {('genre', 'file_name')},
+            },
+        ),
+        migrations.CreateModel(
+            name='NGramCount',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('genre', models.CharField(choices=[(pocketmovie.enums.Genre('action'), 'action'), (pocketmovie.enums.Genre('romance'), 'romance'), (pocketmovie.enums.Genre('horror'), 'horror')], max_length=20)),
+                ('kind', models.CharField(choices=[(pocketmovie.enums.NGramKind('context'), 'context'), (pocketmovie.enums.NGramKind('type'), 'type')], max_length=20)),
+                ('gram_1', models.CharField(max_length=30)),
+                ('gram_2', models.CharField(blank=True, default='', max_length=30)),
+                ('gram_3', models.CharField(blank=True, default='', max_length=30)),
+                ('count', models.IntegerField(default=0)),
+            ],
+            options={
+                'unique_together': {('genre', 'kind', 'gram_1', 'gram_2', 'gram_3')},
+            },
+        ),
+    ]
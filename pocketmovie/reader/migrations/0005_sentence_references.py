@@ -0,0 +1,31 @@
+# Generated by Django 2.2.8 on 2026-10-18 13:36
+
+from django.db import migrations, models
+
+
+# Forget stored script hashes so the next ingestion parses every script again and records the sentences it
+# contributes, after which sentences no script references are removed
+def reset_manifest_hashes(apps, schema_editor):
+    ScriptManifest = apps.get_model('reader', 'ScriptManifest')
+    ScriptManifest.objects.update(content_hash='')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('reader', '0004_ngramcount_scriptmanifest'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='scriptmanifest',
+            name='sentence_hashes',
+            field=models.TextField(default='[]'),
+        ),
+        migrations.AddField(
+            model_name='sentence',
+            name='references',
+            field=models.IntegerField(default=0),
+        ),
+        migrations.RunPython(reset_manifest_hashes, migrations.RunPython.noop),
+    ]
@@ -1,3 +1,5 @@
+import hashlib
+
 from django.db import models
 
 from pocketmovie import enums
@@ -17,12 +19,29 @@ class Sentence(models.Model):
         max_length=20,
         choices=[(t, t.value) for t in enums.SentenceType]
     )
+    # Unique digest of all other fields, used to skip duplicates on bulk insert
+    text_hash = models.CharField(max_length=64, unique=True, editable=False)
+    # Number of script manifests contributing the sentence, which is removed once none do
+    references = models.IntegerField(default=0)
 
     def __str__(self):
         return self.text
 
+    @staticmethod
+    def content_hash(text, genre, sentence_context, sentence_type):
+        content = '\x1f'.join([str(genre), str(sentence_context), str(sentence_type), text])
+        return hashlib.sha256(content.encode('utf-8')).hexdigest()
+
+    def save(self, *args, **kwargs):
+        self.text_hash = self.content_hash(self.text, self.genre, self.sentence_context, self.sentence_type)
+        super().save(*args, **kwargs)
+
 
 class StartSymbol(models.Model):
+    genre = models.CharField(
+        max_length=20,
+        choices=[(g, g.value) for g in enums.Genre]
+    )
     sentence_context = models.CharField(
         max_length=20,
         choices=[(c, c.value) for c in enums.SentenceContext]
@@ -35,5 +54,47 @@ class StartSymbol(models.Model):
 
     class Meta:
         unique_together = [
-            ('sentence_context', 'sentence_type')
+            ('genre', 'sentence_context', 'sentence_type')
+        ]
+
+
+class NGramCount(models.Model):
+    genre = models.CharField(
+        max_length=20,
+        choices=[(g, g.value) for g in enums.Genre]
+    )
+    kind = models.CharField(
+        max_length=20,
+        choices=[(k, k.value) for k in enums.NGramKind]
+    )
+    gram_1 = models.CharField(max_length=30)
+    gram_2 = models.CharField(max_length=30, blank=True, default='')
+    gram_3 = models.CharField(max_length=30, blank=True, default='')
+    count = models.IntegerField(default=0)
+
+    class Meta:
+        unique_together = [
+            ('genre', 'kind', 'gram_1', 'gram_2', 'gram_3')
+        ]
+
+    def joined_sequence(self):
+        return tuple(gram for gram in (self.gram_1, self.gram_2, self.gram_3) if gram)
+
+
+class ScriptManifest(models.Model):
+    genre = models.CharField(
+        max_length=20,
+        choices=[(g, g.value) for g in enums.Genre]
+    )
+    file_name = models.CharField(max_length=200)
+    content_hash = models.CharField(max_length=64)
+    sentence_total = models.IntegerField(default=0)
+    # Raw counts contributed by the script as JSON, withdrawn from the totals when it changes
+    counts = models.TextField(default='{}')
+    # Hashes of the sentences contributed by the script as JSON, dereferenced when it changes
+    sentence_hashes = models.TextField(default='[]')
+
+    class Meta:
+        unique_together = [
+            ('genre', 'file_name')
         ]
@@ -1,21 +1,238 @@
+from collections import Counter
+import csv
+import hashlib
+import json
+import multiprocessing
+from operator import attrgetter
 import os
+import pickle
 import re
 import sys
+import time
 
+from django.db import connections, transaction
+from django.db.models import F, Sum
 import nltk
-import pandas as pd
+import numpy as np
 import spacy
 
-from pocketmovie.enums import Genre, SentenceContext, SentenceType
-from reader.models import Sentence, StartSymbol
+from pocketmovie.enums import Genre, NGramKind, SentenceContext, SentenceType
+from reader.ingestion_report import IngestionReport, StageTimer
+from reader.models import NGramCount, ScriptManifest, Sentence, StartSymbol
 import writer.models as w_models
+from writer.transition_tables import clear_start_samplers
 
 
-ACTOR_NAME_REGEX = re.compile(r'([A-Z]+)[\n\r]+(.*)')
-NUMBER_REGEX = re.compile(r'\d')
-UPPERCASE_REGEX = re.compile(r'[A-Z]{3,}')
-WEBSITE_REGEX = re.compile(r'\.(com|org|net|io|co|us)', re.IGNORECASE)
+# Line with letters, none of them lower case
+CUE_REGEX = re.compile(r'^[^a-z]*[A-Z][^a-z]*$')
+SCENE_HEADING_REGEX = re.compile(r'^(\d+\s*)?(INT|EXT|INTERIOR|EXTERIOR)\b')
+PAGE_NUMBER_REGEX = re.compile(r'^\d+\.?$')
+# Every scan_text check as one alternation, each branch consuming only characters that cannot start another,
+# behind a lookahead of possible first characters that lets the regex engine skip everything else quickly
+TEXT_FLAGS_REGEX = re.compile(
+    r'(?=[\d.A-Z?(ywmoYWMO])(?:'
+    r'(?P<number>\d)'
+    r'|(?P<website>\.(?=(?i:com|org|net|io|co|us)))'
+    r'|(?P<direction>[A-Z]{2}(?=[A-Z]))'
+    r'|(?P<direct_address>I |you|You|your|Your|we|We|\?|my|My|mine|Mine|our|Our)'
+    r'|(?P<parenthesis>\())'
+)
 PATH_TO_SCRIPTS = 'training_data/raw_text_scripts/'
+US_NAMES_CSV_PATH = 'reader/NationalNames.csv'
+US_NAMES_LEXICON_PATH = 'reader/NationalNames.pickle'
+INGESTION_REPORT_PATH = 'ingestion_report.json'
+# Most words in a character cue that is not indented past its dialogue
+CUE_WORD_CEILING = 4
+# Sentences handed to spacy at a time by nlp.pipe
+SPACY_BATCH_SIZE = 512
+# Sentences buffered before each bulk insert
+SENTENCE_WRITE_BATCH_SIZE = 2000
+# Sentence hashes per reference count update, within SQLite's limit on query parameters
+SENTENCE_REFERENCE_BATCH_SIZE = 500
+# Pipeline components whose annotations are never read during ingestion
+SPACY_UNUSED_COMPONENTS = ['parser', 'ner']
+# Count dictionaries of a ScriptResult that are stored in script manifests
+COUNT_FIELDS = ('type_counts', 'context_counts', 'start_counts')
+# Probability models of each ngram kind, by degree
+PROBABILITY_MODELS = {
+    NGramKind.CONTEXT: (
+        w_models.ContextUnigramKeyValue,
+        w_models.ContextBigramKeyValue,
+        w_models.ContextTrigramKeyValue,
+    ),
+    NGramKind.TYPE: (
+        w_models.TypeUnigramKeyValue,
+        w_models.TypeBigramKeyValue,
+        w_models.TypeTrigramKeyValue,
+    ),
+}
+
+# Linguistic resources loaded once per process by _init_worker
+_worker_nlp = None
+_worker_us_names = None
+
+
+class ScriptResult:
+    # Counts and sentence rows gathered from one script, or merged from several
+    def __init__(self, genre, path=None):
+        self.genre = genre
+        self.path = path
+        self.type_counts = dict()
+        self.context_counts = dict()
+        self.start_counts = dict()
+        # Changes to how many scripts contribute each sentence, by sentence hash
+        self.sentence_references = dict()
+        self.sentences = []
+        self.total = 0
+        self.seconds = 0
+        self.timer = StageTimer()
+
+    @property
+    def file_name(self):
+        return os.path.basename(self.path)
+
+    # Serialize counts as JSON with string grams, the form kept in script manifests
+    def dump_counts(self):
+        return json.dumps({
+            field: [[[str(gram) for gram in key], count] for key, count in getattr(self, field).items()]
+            for field in COUNT_FIELDS
+        })
+
+    # Add counts serialized by dump_counts, negated when withdrawing a script
+    def merge_dumped_counts(self, dumped, sign=1):
+        for field, items in json.loads(dumped).items():
+            merge_counts(getattr(self, field), {tuple(key): sign * count for key, count in items})
+
+    # Add one reference to each sentence hash, or take one away when withdrawing a script
+    def reference_sentences(self, text_hashes, sign=1):
+        merge_counts(self.sentence_references, {text_hash: sign for text_hash in text_hashes})
+
+
+class SentenceWriter:
+    # Buffer sentences and insert them in bulk, one transaction per flush
+    def __init__(self, batch_size=SENTENCE_WRITE_BATCH_SIZE):
+        self.batch_size = batch_size
+        self.buffer = []
+        self.seen_hashes = set()
+        self.rows_queued = 0
+
+    # Queue a sentence unless an identical one was already queued, flushing when the buffer is full, and return its hash
+    def add(self, text, genre, sentence_context, sentence_type):
+        text_hash = Sentence.content_hash(text, genre, sentence_context, sentence_type)
+        if text_hash in self.seen_hashes:
+            return text_hash
+        self.seen_hashes.add(text_hash)
+        self.rows_queued += 1
+        self.buffer.append(Sentence(
+            text=text,
+            genre=genre,
+            sentence_context=sentence_context,
+            sentence_type=sentence_type,
+            text_hash=text_hash
+        ))
+        if len(self.buffer) >= self.batch_size:
+            self.flush()
+        return text_hash
+
+    # Insert buffered sentences, leaving rows already stored by earlier runs untouched
+    def flush(self):
+        if self.buffer:
+            with transaction.atomic():
+                Sentence.objects.bulk_create(self.buffer, ignore_conflicts=True)
+            self.buffer = []
+
+
+# Width of leading whitespace on a line
+def _indentation(line):
+    line = line.expandtabs()
+    return len(line) - len(line.lstrip())
+
+
+# Paragraphs with each cue left alone by a blank line joined to the speech in the paragraph after it
+def _join_lone_cues(paragraphs):
+    held = None
+    for paragraph in paragraphs:
+        if held and is_character_cue(held[0], paragraph[0]):
+            paragraph = held + paragraph
+        elif held:
+            yield held
+        held = None
+        if len(paragraph) == 1:
+            held = paragraph
+        else:
+            yield paragraph
+    if held:
+        yield held
+
+
+# Description and direction sentences of action lines with their contexts and text flags
+def _narrative_sentences(lines, timer):
+    for sentence in nltk.sent_tokenize(' '.join(' '.join(lines).split())):
+        flags = timer.call('filters', scan_text, sentence)
+        if 'direction' in flags:
+            yield sentence, SentenceContext.DIRECTION, flags
+        else:
+            yield sentence, SentenceContext.DESCRIPTION, flags
+
+
+# Model fields for an ngram tuple, leaving missing degrees blank
+def _ngram_fields(ngram):
+    grams = [str(gram) for gram in ngram] + [''] * (3 - len(ngram))
+    return {'gram_1': grams[0], 'gram_2': grams[1], 'gram_3': grams[2]}
+
+
+# Load spacy and names lexicon into the current process
+def _init_worker():
+    global _worker_nlp, _worker_us_names
+    if _worker_nlp is None:
+        _worker_nlp = load_spacy()
+        _worker_us_names = get_us_names()
+
+
+# Sentences of a script worth classifying, counting every sentence toward the script total
+def _kept_sentences(path, result):
+    for sentence, sentence_context, flags in iter_script_sentences(path, result.timer):
+        result.total += 1
+        # Avoid chronological discontinuity
+        if not ('number' in flags or 'website' in flags):
+            yield sentence, (sentence_context, flags)
+
+
+# Pool entry point, parsing one (path, genre, batch size) job with the process resources
+def _parse_script_job(job):
+    path, genre, batch_size = job
+    return parse_script(path, genre, _worker_nlp, _worker_us_names, batch_size)
+
+
+# Fold one script's counts into its genre's pending changes, withdrawing any earlier version, and save its sentences
+def _store_script_result(result, delta, writer, manifests, report):
+    # Print current file to console
+    sys.stdout.write('\r')
+    sys.stdout.write('Parsing file (%s): %s%s' % (result.genre.value, result.file_name, 20 * ' '))
+    sys.stdout.flush()
+    report.add_script(result)
+    report.timer.enter('database')
+    manifest = manifests[result.file_name]
+    if manifest.pk:
+        delta.merge_dumped_counts(manifest.counts, -1)
+        delta.reference_sentences(json.loads(manifest.sentence_hashes), -1)
+    manifest.counts = result.dump_counts()
+    manifest.sentence_total = result.total
+    delta.merge_dumped_counts(manifest.counts)
+    text_hashes = sorted({
+        writer.add(text, result.genre, sentence_context, sentence_type)
+        for text, sentence_context, sentence_type in result.sentences
+    })
+    manifest.sentence_hashes = json.dumps(text_hashes)
+    delta.reference_sentences(text_hashes)
+    writer.flush()
+    report.timer.exit()
+
+
+# Stream sentences with their accompanying context through spacy in batches
+def annotate_sentences(nlp, sentences, batch_size=SPACY_BATCH_SIZE):
+    for doc, context in nlp.pipe(sentences, as_tuples=True, batch_size=batch_size):
+        yield doc.text, context, doc
 
 
 # Back off ngram degrees until existing count is found
@@ -43,21 +260,28 @@ def classify_type(text, doc):
         return SentenceType.DECLARATIVE
 
 
+# Compile upper case names from Social Security database into a pickled frozen set
+def compile_us_names(csv_path=US_NAMES_CSV_PATH, lexicon_path=US_NAMES_LEXICON_PATH):
+    with open(csv_path, newline='') as f:
+        us_names = frozenset(row['Name'].upper() for row in csv.DictReader(f))
+    with open(lexicon_path, 'wb') as f:
+        pickle.dump(us_names, f, protocol=pickle.HIGHEST_PROTOCOL)
+    return us_names
+
+
 # Search for number
 def contains_number(text):
-    return bool(NUMBER_REGEX.search(text))
+    return 'number' in scan_text(text)
 
 
 # Check for human name in words
 def contains_name(doc, all_names):
-    return any([(token.pos_ == 'PROPN' or
-                token.text.upper() in all_names)
-                for token in doc])
+    return any(token.pos_ == 'PROPN' or token.text.upper() in all_names for token in doc)
 
 
 # Search for a URL pattern
 def contains_website(text):
-    return bool(WEBSITE_REGEX.search(text))
+    return 'website' in scan_text(text)
 
 
 # Store new counts for ngrams as dictionary values
@@ -79,177 +303,366 @@ def count_ngrams(type_counts, context_counts, type_ngram, context_ngram, sentenc
     return type_ngram, context_ngram
 
 
-# Retrieve lexicon of 94,000 most common US names, courtesy Social Security database
-def get_us_names():
-    us_names = list(pd.DataFrame(pd.read_csv('reader/NationalNames.csv'))['Name'])
-    for index, _ in enumerate(us_names):
-        us_names[index] = us_names[index].upper()
-    return us_names
+# Retrieve lexicon of 94,000 most common US names, recompiling only when the database is newer than the lexicon
+def get_us_names(csv_path=US_NAMES_CSV_PATH, lexicon_path=US_NAMES_LEXICON_PATH):
+    if os.path.exists(lexicon_path) and (not os.path.exists(csv_path)
+                                         or os.path.getmtime(lexicon_path) >= os.path.getmtime(csv_path)):
+        with open(lexicon_path, 'rb') as f:
+            return pickle.load(f)
+    return compile_us_names(csv_path, lexicon_path)
 
 
 def has_direct_address(text):
-    return any([word in text for word in ['I ', 'you', 'You', 'your', 'Your', 'we',
-                                          'We', '?', 'my', 'My', 'mine', 'Mine', 'our', 'Our']])
+    return 'direct_address' in scan_text(text)
+
 
+# Digest of script contents, read in blocks
+def hash_script(path):
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(1 << 16), b''):
+            digest.update(block)
+    return digest.hexdigest()
 
-# Sentence contains entity that is an individual name
-def is_actor_name(text):
-    name_search = ACTOR_NAME_REGEX.search(text)
-    if name_search:
-        return not (is_direction(name_search.group(2)) or name_search.group(2).strip()[0] == '(')
-    return False
+
+# Customary for character cues to be short upper case lines, indented past or followed by their dialogue
+def is_character_cue(line, next_line):
+    text = line.strip()
+    if (not CUE_REGEX.match(text)
+            or text.startswith('(')
+            or text.endswith(':')
+            or SCENE_HEADING_REGEX.match(text)):
+        return False
+    return (_indentation(line) > _indentation(next_line)
+            or next_line.strip().startswith('(')
+            or (len(text.split()) <= CUE_WORD_CEILING
+                and not text.endswith(('.', '!', '?', '-'))
+                and any(c.islower() for c in next_line)))
 
 
 # Customary for directions to be in all upper case
 def is_direction(text):
-    return bool(UPPERCASE_REGEX.search(text))
+    return 'direction' in scan_text(text)
+
 
+# Group lines into paragraphs separated by blank lines and page numbers, reading one line at a time
+def iter_paragraphs(lines):
+    paragraph = []
+    for line in lines:
+        line = line.rstrip()
+        if line.strip() and not PAGE_NUMBER_REGEX.match(line.strip()):
+            paragraph.append(line)
+        elif paragraph:
+            yield paragraph
+            paragraph = []
+    if paragraph:
+        yield paragraph
 
-# Retrieve Spacy linguistics analysis package
+
+# Yield screenplay sentences with their context and text flags, telling cues, dialogue and directions apart line by line
+def iter_screenplay(lines, timer=None):
+    timer = timer or StageTimer()
+    # Indentation of action lines so far, the most common of which is the script's action margin
+    action_indentations = Counter()
+    for paragraph in _join_lone_cues(iter_paragraphs(lines)):
+        if len(paragraph) > 1 and is_character_cue(paragraph[0], paragraph[1]):
+            action_indentation = action_indentations.most_common(1)[0][0] if action_indentations else -1
+            dialogue_lines = []
+            dialogue_indentation = None
+            in_parenthetical = False
+            action_lines = []
+            # Leave out actor directions such as (beat) between dialogue lines
+            for position, line in enumerate(paragraph[1:], 1):
+                in_parenthetical = in_parenthetical or line.strip().startswith('(')
+                if not in_parenthetical:
+                    if dialogue_indentation is None:
+                        dialogue_indentation = _indentation(line)
+                    elif _indentation(line) <= action_indentation < dialogue_indentation:
+                        # Action resumes at its own margin without a blank line after the speech
+                        action_lines = paragraph[position:]
+                        break
+                    dialogue_lines.append(line)
+                elif ')' in line:
+                    in_parenthetical = False
+            for sentence in nltk.sent_tokenize(' '.join(' '.join(dialogue_lines).split())):
+                yield sentence, SentenceContext.DIALOGUE, timer.call('filters', scan_text, sentence)
+            yield from _narrative_sentences(action_lines, timer)
+        else:
+            action_indentations.update(_indentation(line) for line in paragraph)
+            yield from _narrative_sentences(paragraph, timer)
+
+
+# Stream sentences of a script file with their contexts and text flags, excluding title and ending
+def iter_script_sentences(path, timer=None):
+    with open(path, 'r') as f:
+        sentences = iter_screenplay(f, timer)
+        next(sentences, None)
+        previous = next(sentences, None)
+        for sentence in sentences:
+            yield previous
+            previous = sentence
+
+
+# Stored raw ngram counts of a kind for genre, keyed by tuples of grams
+def load_ngram_counts(kind, genre):
+    return {
+        ngram_count.joined_sequence(): ngram_count.count
+        for ngram_count in NGramCount.objects.filter(genre=genre, kind=kind, count__gt=0)
+    }
+
+
+# Retrieve Spacy linguistics analysis package, keeping only the tagger that provides part of speech
 def load_spacy():
-    return spacy.load('en_core_web_sm')
+    return spacy.load('en_core_web_sm', disable=SPACY_UNUSED_COMPONENTS)
 
 
-# Include ngram counts in database as KeyValue objects
-def unpack_counts(type_counts, context_counts, total, genre):
-    # Crude smoothing
-    for type_count in type_counts:
-        type_counts[type_count] += 1
-    # Calculate ngram probabilities for types
-    for type_count in type_counts:
-        if len(type_count) == 1:
-            w_models.TypeUnigramKeyValue.objects.get_or_create(
-                genre=genre,
-                gram_1=type_count[0],
-                probability=back_off(type_counts, type_count, total)
-            )
-        elif len(type_count) == 2:
-            w_models.TypeBigramKeyValue.objects.get_or_create(
-                genre=genre,
-                gram_1=type_count[0],
-                gram_2=type_count[1],
-                probability=back_off(type_counts, type_count, total)
-            )
-        elif len(type_count) == 3:
-            w_models.TypeTrigramKeyValue.objects.get_or_create(
-                genre=genre,
-                gram_1=type_count[0],
-                gram_2=type_count[1],
-                gram_3=type_count[2],
-                probability=back_off(type_counts, type_count, total)
-            )
-    # Crude smoothing
-    for context_count in context_counts:
-        context_counts[context_count] += 1
-    # Calculate ngram probabilities for contexts
-    for context_count in context_counts:
-        if len(context_count) == 1:
-            w_models.ContextUnigramKeyValue.objects.get_or_create(
-                genre=genre,
-                gram_1=context_count[0],
-                probability=back_off(context_counts, context_count, total)
-            )
-        elif len(context_count) == 2:
-            w_models.ContextBigramKeyValue.objects.get_or_create(
-                genre=genre,
-                gram_1=context_count[0],
-                gram_2=context_count[1],
-                probability=back_off(context_counts, context_count, total)
-            )
-        elif len(context_count) == 3:
-            w_models.ContextTrigramKeyValue.objects.get_or_create(
+# Probability of every ngram in counts at once, with crude smoothing and the same result as back_off
+def ngram_probabilities(counts, total):
+    ngrams = list(counts)
+    positions = {ngram: position for position, ngram in enumerate(ngrams)}
+    smoothed = np.fromiter(counts.values(), dtype=float, count=len(ngrams)) + 1
+    # Ngrams are conditioned on the count of their history, unigrams on the total
+    histories = np.array([positions.get(ngram[:-1], -1) for ngram in ngrams], dtype=int)
+    denominators = np.where(histories >= 0, smoothed[histories], total) if ngrams else smoothed
+    probabilities = dict(zip(ngrams, (smoothed / denominators).tolist()))
+    smoothed_counts = dict(zip(ngrams, smoothed.tolist()))
+    # Histories are always counted along with their ngrams, but back off like back_off if one is missing
+    for ngram, history in zip(ngrams, histories):
+        if history < 0 and len(ngram) > 1:
+            probabilities[ngram] = back_off(smoothed_counts, ngram, total)
+    return probabilities
+
+
+# Add counts from one dictionary into another
+def merge_counts(target, source):
+    for key, count in source.items():
+        if key in target:
+            target[key] += count
+        else:
+            target[key] = count
+
+
+# Recompute ngram probabilities for genre from its stored raw counts
+def rebuild_probabilities(genre):
+    total = ScriptManifest.objects.filter(genre=genre).aggregate(total=Sum('sentence_total'))['total']
+    with transaction.atomic():
+        return unpack_counts(
+            load_ngram_counts(NGramKind.TYPE, genre) if total else dict(),
+            load_ngram_counts(NGramKind.CONTEXT, genre) if total else dict(),
+            total,
+            genre
+        )
+
+
+# Apply a genre's pending count changes and manifest updates in one transaction
+def store_genre_changes(delta, manifests, removed_manifests):
+    with transaction.atomic():
+        for manifest in removed_manifests:
+            delta.merge_dumped_counts(manifest.counts, -1)
+            delta.reference_sentences(json.loads(manifest.sentence_hashes), -1)
+            manifest.delete()
+        rows = (store_ngram_counts(delta.type_counts, NGramKind.TYPE, delta.genre)
+                + store_ngram_counts(delta.context_counts, NGramKind.CONTEXT, delta.genre)
+                + store_start_counts(delta.start_counts, delta.genre)
+                + store_sentence_references(delta.sentence_references, delta.genre))
+        for manifest in manifests:
+            manifest.save()
+            rows += 1
+    return rows
+
+
+# Add ngram count changes of a kind for genre to database as atomic increments, creating missing rows first
+def store_ngram_counts(ngram_counts, kind, genre):
+    with transaction.atomic():
+        NGramCount.objects.bulk_create([
+            NGramCount(genre=genre, kind=kind, **_ngram_fields(ngram))
+            for ngram in ngram_counts
+        ], ignore_conflicts=True)
+        for ngram, count in ngram_counts.items():
+            if count:
+                NGramCount.objects.filter(
+                    genre=genre,
+                    kind=kind,
+                    **_ngram_fields(ngram)
+                ).update(count=F('count') + count)
+        # Ngrams whose only scripts were withdrawn
+        NGramCount.objects.filter(genre=genre, kind=kind, count__lte=0).delete()
+    return len(ngram_counts)
+
+
+# Upsert probability rows of model for genre keyed on their grams, removing ngrams no longer counted,
+# and return the number of rows written
+def store_probabilities(model, degree, probabilities, genre):
+    gram_fields = ['gram_1', 'gram_2', 'gram_3'][:degree]
+    existing = {
+        tuple(getattr(row, field) for field in gram_fields): row
+        for row in model.objects.filter(genre=genre)
+    }
+    created = []
+    updated = []
+    for ngram, probability in probabilities.items():
+        row = existing.pop(tuple(str(gram) for gram in ngram), None)
+        if row is None:
+            created.append(model(genre=genre, probability=probability, **dict(zip(gram_fields, ngram))))
+        elif row.probability != probability:
+            row.probability = probability
+            updated.append(row)
+    with transaction.atomic():
+        model.objects.bulk_create(created)
+        model.objects.bulk_update(updated, ['probability'], batch_size=500)
+        model.objects.filter(pk__in=[row.pk for row in existing.values()]).delete()
+    return len(created) + len(updated) + len(existing)
+
+
+# Apply changes to sentence reference counts for genre as atomic increments, then remove sentences no script
+# contributes any longer
+def store_sentence_references(sentence_references, genre):
+    by_change = dict()
+    for text_hash, change in sentence_references.items():
+        if change:
+            by_change.setdefault(change, []).append(text_hash)
+    with transaction.atomic():
+        for change, text_hashes in by_change.items():
+            for start in range(0, len(text_hashes), SENTENCE_REFERENCE_BATCH_SIZE):
+                Sentence.objects.filter(
+                    text_hash__in=text_hashes[start:start + SENTENCE_REFERENCE_BATCH_SIZE]
+                ).update(references=F('references') + change)
+        Sentence.objects.filter(genre=genre, references__lte=0).delete()
+    return len(sentence_references)
+
+
+# Add start symbol counts for genre to database as atomic increments, creating missing rows first
+def store_start_counts(start_counts, genre):
+    with transaction.atomic():
+        StartSymbol.objects.bulk_create([
+            StartSymbol(genre=genre, sentence_context=sentence_context, sentence_type=sentence_type)
+            for sentence_context, sentence_type in start_counts
+        ], ignore_conflicts=True)
+        for (sentence_context, sentence_type), count in start_counts.items():
+            if not count:
+                continue
+            StartSymbol.objects.filter(
                 genre=genre,
-                gram_1=context_count[0],
-                gram_2=context_count[1],
-                gram_3=context_count[2],
-                probability=back_off(context_counts, context_count, total)
-            )
+                sentence_context=sentence_context,
+                sentence_type=sentence_type
+            ).update(count=F('count') + count)
+        # Start symbols whose only scripts were withdrawn
+        StartSymbol.objects.filter(genre=genre, count__lte=0).delete()
+    clear_start_samplers()
+    return len(start_counts)
+
+
+# Flags for every pattern in a sentence, found in a single pass
+def scan_text(text):
+    return frozenset(map(attrgetter('lastgroup'), TEXT_FLAGS_REGEX.finditer(text)))
+
+
+# Include ngram counts in database as KeyValue objects, updating rows that already exist for genre
+def unpack_counts(type_counts, context_counts, total, genre):
+    rows = 0
+    for kind, counts in ((NGramKind.TYPE, type_counts), (NGramKind.CONTEXT, context_counts)):
+        probabilities = ngram_probabilities(counts, total)
+        for degree, model in enumerate(PROBABILITY_MODELS[kind], 1):
+            rows += store_probabilities(model, degree, {
+                ngram: probability for ngram, probability in probabilities.items() if len(ngram) == degree
+            }, genre)
+    return rows
+
+
+# Parse a single script and gather its ngram counts, start symbols and kept sentences
+def parse_script(path, genre, nlp, us_names, batch_size=SPACY_BATCH_SIZE):
+    started = time.perf_counter()
+    result = ScriptResult(genre, path)
+    timer = result.timer
+    # Time not spent in a nested stage goes to classification and counting
+    timer.enter('classify')
+    type_counts = result.type_counts
+    context_counts = result.context_counts
+    type_ngram = ()
+    context_ngram = ()
+    sentences = timer.iterate('tokenize', _kept_sentences(path, result))
+    annotated = timer.iterate('spacy', annotate_sentences(nlp, sentences, batch_size))
+    for sentence, (sentence_context, flags), doc in annotated:
+        sentence_type = classify_type(sentence, doc)
+        if sentence_context == SentenceContext.DIALOGUE:
+            # Sentence is spoken by a character
+            type_ngram, context_ngram = count_ngrams(type_counts, context_counts, type_ngram,
+                                                     context_ngram, sentence_type,
+                                                     SentenceContext.DIALOGUE)
+            if not timer.call('names', contains_name, doc, us_names):
+                result.sentences.append((sentence, SentenceContext.DIALOGUE, sentence_type))
+        elif sentence_context == SentenceContext.DIRECTION:
+            # Sentence is a direction
+            type_ngram, context_ngram = count_ngrams(type_counts, context_counts, type_ngram,
+                                                     context_ngram, sentence_type,
+                                                     SentenceContext.DIRECTION)
+            if not ('direct_address' in flags
+                    or 'parenthesis' in flags
+                    or timer.call('names', contains_name, doc, us_names)):
+                result.sentences.append((sentence, SentenceContext.DIRECTION, sentence_type))
+        elif not timer.call('names', contains_name, doc, us_names):
+            # Avoid social/geographic discontinuities
+            # Sentence is most likely a description
+            type_ngram, context_ngram = count_ngrams(type_counts, context_counts, type_ngram,
+                                                     context_ngram, sentence_type,
+                                                     SentenceContext.DESCRIPTION)
+            if 'direct_address' not in flags:
+                result.sentences.append((sentence, SentenceContext.DESCRIPTION, sentence_type))
+        else:
+            continue
+        # Track starting sentence types for each context
+        start_key = (sentence_context, sentence_type)
+        result.start_counts[start_key] = result.start_counts.get(start_key, 0) + 1
+    timer.exit()
+    result.seconds = time.perf_counter() - started
+    return result
 
 
-def populate_script_sentences():
-    nlp = load_spacy()
-    us_names = get_us_names()
-    # Script directories by genre for all genres in genre enum
+# Parse new or changed scripts in the corpus, using a pool of worker processes when more than one worker is requested,
+# and write a JSON report of stage timings and throughput
+def populate_script_sentences(workers=1, batch_size=SPACY_BATCH_SIZE, report_path=INGESTION_REPORT_PATH):
+    report = IngestionReport(workers)
+    report.timer.enter('manifest')
+    jobs = []
+    manifests = dict()
+    removed_manifests = dict()
+    # Scripts in each genre directory for all genres in genre enum
     for genre in Genre:
-        type_counts = dict()
-        context_counts = dict()
-        total = 0
         root = PATH_TO_SCRIPTS + genre.value + '/'
-        file_names = os.listdir(root)
-        # Scripts in each genre directory
-        for name in file_names:
-            # Print current file to console
-            sys.stdout.write('\r')
-            sys.stdout.write('Parsing file (%s): %s%s' % (genre.value, name, 20 * ' '))
-            sys.stdout.flush()
-            with open(root + name, 'r') as f:
-                script_text = f.read().strip()
-            # Sentence tokens of script, excluding title and ending
-            sentences = nltk.sent_tokenize(script_text)[1:-1]
-            total += len(sentences)
-            type_ngram = ()
-            context_ngram = ()
-            for sentence in sentences:
-                # Avoid chronological discontinuity
-                if not (contains_number(sentence) or contains_website(sentence)):
-                    doc = nlp(sentence)
-                    sentence_type = classify_type(sentence, doc)
-                    current_context = None
-                    if is_actor_name(sentence):
-                        # Sentence is an actor name
-                        trailing_dialogue = ACTOR_NAME_REGEX.search(sentence)
-                        if trailing_dialogue.group(2):
-                            # Actor name is followed by dialogue
-                            dialogue_text = trailing_dialogue.group(2)
-                            next_sentence_type = classify_type(trailing_dialogue.group(2), doc)
-                            type_ngram, context_ngram = count_ngrams(type_counts, context_counts, type_ngram,
-                                                                     context_ngram, next_sentence_type,
-                                                                     SentenceContext.DIALOGUE)
-                            current_context = SentenceContext.DIALOGUE
-                            doc = nlp(dialogue_text)
-                            if not contains_name(doc, us_names):
-                                Sentence.objects.get_or_create(
-                                    text=dialogue_text,
-                                    genre=genre,
-                                    sentence_context=SentenceContext.DIALOGUE,
-                                    sentence_type=next_sentence_type
-                                )
-                    elif is_direction(sentence):
-                        # Sentence is a direction
-                        type_ngram, context_ngram = count_ngrams(type_counts, context_counts, type_ngram,
-                                                                 context_ngram, sentence_type,
-                                                                 SentenceContext.DIRECTION)
-                        current_context = SentenceContext.DIRECTION
-                        if not (has_direct_address(sentence)
-                                or contains_name(doc, us_names)
-                                or '(' in sentence):
-                            Sentence.objects.get_or_create(
-                                text=sentence,
-                                genre=genre,
-                                sentence_context=SentenceContext.DIRECTION,
-                                sentence_type=sentence_type
-                            )
-                    elif not contains_name(doc, us_names):
-                        # Avoid social/geographic discontinuities
-                        # Sentence is most likely a description
-                        type_ngram, context_ngram = count_ngrams(type_counts, context_counts, type_ngram,
-                                                                 context_ngram, sentence_type,
-                                                                 SentenceContext.DESCRIPTION)
-                        current_context = SentenceContext.DESCRIPTION
-                        if not (has_direct_address(sentence) or contains_name(doc, us_names)):
-                            Sentence.objects.get_or_create(
-                                text=sentence,
-                                genre=genre,
-                                sentence_context=SentenceContext.DESCRIPTION,
-                                sentence_type=sentence_type
-                            )
-                    if current_context:
-                        # Track starting sentence types for each context
-                        start, _ = StartSymbol.objects.get_or_create(
-                            sentence_context=current_context,
-                            sentence_type=sentence_type
-                        )
-                        start.count += 1
-                        start.save()
-        unpack_counts(type_counts, context_counts, total, genre)
+        stored = {manifest.file_name: manifest for manifest in ScriptManifest.objects.filter(genre=genre)}
+        manifests[genre] = dict()
+        for name in sorted(os.listdir(root)):
+            content_hash = hash_script(root + name)
+            manifest = stored.pop(name, None) or ScriptManifest(genre=genre, file_name=name)
+            # Skip scripts unchanged since they were last counted
+            if manifest.content_hash != content_hash:
+                manifest.content_hash = content_hash
+                manifests[genre][name] = manifest
+                jobs.append((root + name, genre, batch_size))
+        removed_manifests[genre] = list(stored.values())
+    report.timer.exit()
+    deltas = {genre: ScriptResult(genre) for genre in Genre}
+    writer = SentenceWriter()
+    sentence_rows = Sentence.objects.count()
+    if workers > 1 and jobs:
+        # Forked workers must not share the parent's database connection
+        connections.close_all()
+        with multiprocessing.Pool(workers, initializer=_init_worker) as pool:
+            for result in pool.imap(_parse_script_job, jobs):
+                _store_script_result(result, deltas[result.genre], writer, manifests[result.genre], report)
+    elif jobs:
+        report.timer.call('load_resources', _init_worker)
+        for result in map(_parse_script_job, jobs):
+            _store_script_result(result, deltas[result.genre], writer, manifests[result.genre], report)
+    report.timer.enter('database')
+    for genre, delta in deltas.items():
+        if manifests[genre] or removed_manifests[genre]:
+            report.count_rows('counts', store_genre_changes(delta, manifests[genre].values(), removed_manifests[genre]))
+            report.count_rows('probabilities', rebuild_probabilities(genre))
+    report.count_rows('sentences_queued', writer.rows_queued)
+    report.count_rows('sentences_inserted', Sentence.objects.count() - sentence_rows)
+    report.timer.exit()
     sys.stdout.write('\n')
+    if report_path:
+        return report.write(report_path)
+    return report.summary()
@@ -1,9 +1,14 @@
 from copy import copy
+import os
+import tempfile
 
 from django.test import TestCase
 
 import pocketmovie.enums as enums
+from reader.models import Sentence, StartSymbol
+from reader.ingestion_report import StageTimer
 import reader.sentence_population as sp
+from writer.models import TypeBigramKeyValue, TypeUnigramKeyValue
 
 
 class ReaderTest(TestCase):
@@ -20,6 +25,16 @@ class ReaderTest(TestCase):
             (enums.SentenceContext.DIRECTION, enums.SentenceContext.DIALOGUE): 4,
         }
 
+    def test_annotate_sentences(self):
+        sentences = [
+            ('It is a human toe.', enums.SentenceContext.DESCRIPTION),
+            ('You do not like flying, do you?', enums.SentenceContext.DIALOGUE),
+        ]
+        result = [(sentence, sentence_context, doc.text)
+                  for sentence, sentence_context, doc in sp.annotate_sentences(self.nlp, sentences, 1)]
+        expected = [sentence + (sentence[0],) for sentence in sentences]
+        self.assertEqual(result, expected)
+
     def test_back_off_ngram_exists(self):
         result = sp.back_off(self.type_counts, (enums.SentenceType.DECLARATIVE, enums.SentenceType.IMPERATIVE), 4)
         expected = 2
@@ -59,6 +74,18 @@ class ReaderTest(TestCase):
         expected = enums.SentenceType.DECLARATIVE
         self.assertEqual(result, expected)
 
+    def test_compile_us_names(self):
+        with tempfile.TemporaryDirectory() as directory:
+            csv_path = os.path.join(directory, 'names.csv')
+            lexicon_path = os.path.join(directory, 'names.pickle')
+            with open(csv_path, 'w') as f:
+                f.write('Id,Name,Year,Gender,Count\n1,Mary,1880,F,7065\n2,Anna,1880,F,2604\n3,Mary,1881,F,6919\n')
+            compiled = sp.compile_us_names(csv_path, lexicon_path)
+            os.remove(csv_path)
+            loaded = sp.get_us_names(csv_path, lexicon_path)
+        self.assertEqual(compiled, frozenset({'MARY', 'ANNA'}))
+        self.assertEqual(loaded, compiled)
+
     def test_contains_number_true(self):
         text = 'abc5de'
         self.assertTrue(sp.contains_number(text))
@@ -139,13 +166,20 @@ class ReaderTest(TestCase):
         text = 'The cow jumped over the moon.'
         self.assertFalse(sp.has_direct_address(text))
 
-    def test_is_actor_name_true(self):
-        text = 'JOHN\n\nYou do not like flying, do you?'
-        self.assertTrue(sp.is_actor_name(text))
+    def test_is_character_cue_flush(self):
+        self.assertTrue(sp.is_character_cue('JOHN', 'You do not like flying, do you?'))
 
-    def test_is_actor_name_false(self):
-        text = 'JOHN does not like flying.'
-        self.assertFalse(sp.is_actor_name(text))
+    def test_is_character_cue_sentence(self):
+        self.assertFalse(sp.is_character_cue('JOHN does not like flying.', 'He looks out of the window.'))
+
+    def test_is_character_cue_indented(self):
+        self.assertTrue(sp.is_character_cue('                  JOHN (V.O.)', '          You do not like flying.'))
+
+    def test_is_character_cue_parenthetical(self):
+        self.assertTrue(sp.is_character_cue('          MARINE SGT. SICKMANN', '          (into his radio)'))
+
+    def test_is_character_cue_false(self):
+        self.assertFalse(sp.is_character_cue('     INTERIOR - HYPERSLEEP VAULT', '     A stainless steel room.'))
 
     def test_is_direction_true(self):
         text = 'JOHN does not like flying.'
@@ -154,3 +188,183 @@ class ReaderTest(TestCase):
     def test_is_direction_false(self):
         text = 'Someone does not like flying.'
         self.assertFalse(sp.is_direction(text))
+
+    def test_iter_paragraphs(self):
+        lines = ['  A cat.\r\n', '  It sleeps.\r\n', '\r\n', '                 2.\r\n', '  FADE OUT.\r\n']
+        result = list(sp.iter_paragraphs(lines))
+        expected = [['  A cat.', '  It sleeps.'], ['  FADE OUT.']]
+        self.assertEqual(result, expected)
+
+    def test_iter_screenplay(self):
+        lines = [
+            '          A cat sleeps. JOHN enters.\n',
+            '\n',
+            '                    JOHN\n',
+            '          (quietly)\n',
+            '          You do not like\n',
+            '          flying. Do you?\n',
+        ]
+        result = [(sentence, sentence_context) for sentence, sentence_context, _ in sp.iter_screenplay(lines)]
+        expected = [
+            ('A cat sleeps.', enums.SentenceContext.DESCRIPTION),
+            ('JOHN enters.', enums.SentenceContext.DIRECTION),
+            ('You do not like flying.', enums.SentenceContext.DIALOGUE),
+            ('Do you?', enums.SentenceContext.DIALOGUE),
+        ]
+        self.assertEqual(result, expected)
+
+    def test_iter_screenplay_action_after_dialogue(self):
+        lines = [
+            '          Anna lies still.\n',
+            '\n',
+            '                              PAUL\n',
+            '                    I am sorry Anna.\n',
+            '          He kisses her lips. Eliot watches him\n',
+            '          carefully.\n',
+        ]
+        result = [(sentence, sentence_context) for sentence, sentence_context, _ in sp.iter_screenplay(lines)]
+        expected = [
+            ('Anna lies still.', enums.SentenceContext.DESCRIPTION),
+            ('I am sorry Anna.', enums.SentenceContext.DIALOGUE),
+            ('He kisses her lips.', enums.SentenceContext.DESCRIPTION),
+            ('Eliot watches him carefully.', enums.SentenceContext.DESCRIPTION),
+        ]
+        self.assertEqual(result, expected)
+
+    def test_iter_screenplay_blank_line_after_cue(self):
+        lines = [
+            '     Wednesday holds up the tooth.\n',
+            '\n',
+            '                             WEDNESDAY\n',
+            '\n',
+            '                     (taking her bag)\n',
+            '               Thank you, Lurch.\n',
+            '     Granny tromps up into the attic.\n',
+            '\n',
+            '                             THE END\n',
+        ]
+        result = [(sentence, sentence_context) for sentence, sentence_context, _ in sp.iter_screenplay(lines)]
+        expected = [
+            ('Wednesday holds up the tooth.', enums.SentenceContext.DESCRIPTION),
+            ('Thank you, Lurch.', enums.SentenceContext.DIALOGUE),
+            ('Granny tromps up into the attic.', enums.SentenceContext.DESCRIPTION),
+            ('THE END', enums.SentenceContext.DIRECTION),
+        ]
+        self.assertEqual(result, expected)
+
+    def test_merge_counts(self):
+        type_counts = copy(self.type_counts)
+        sp.merge_counts(type_counts, {
+            (enums.SentenceType.DECLARATIVE,): 1,
+            (enums.SentenceType.EXCLAMATORY,): 3,
+        })
+        expected = {
+            (enums.SentenceType.DECLARATIVE,): 3,
+            (enums.SentenceType.DECLARATIVE, enums.SentenceType.IMPERATIVE): 4,
+            (enums.SentenceType.EXCLAMATORY,): 3,
+        }
+        self.assertEqual(type_counts, expected)
+
+    def test_ngram_probabilities(self):
+        result = sp.ngram_probabilities(self.type_counts, 4)
+        expected = {
+            (enums.SentenceType.DECLARATIVE,): 0.75,
+            (enums.SentenceType.DECLARATIVE, enums.SentenceType.IMPERATIVE): 5 / 3,
+        }
+        self.assertEqual(result, expected)
+
+    def test_scan_text(self):
+        text = 'TAXI driver (Mike) says hi to you at mike.com 5 times?'
+        expected = frozenset({'number', 'website', 'direction', 'direct_address', 'parenthesis'})
+        self.assertEqual(sp.scan_text(text), expected)
+
+    def test_scan_text_overlapping(self):
+        self.assertEqual(sp.scan_text('MAXI said.'), frozenset({'direction', 'direct_address'}))
+        self.assertEqual(sp.scan_text('Go to X.COM'), frozenset({'website', 'direction'}))
+
+    def test_scan_text_empty(self):
+        self.assertEqual(sp.scan_text('The cow jumped over the moon.'), frozenset())
+
+    def test_script_result_dumped_counts(self):
+        result = sp.ScriptResult(enums.Genre.HORROR)
+        result.type_counts = copy(self.type_counts)
+        merged = sp.ScriptResult(enums.Genre.HORROR)
+        merged.merge_dumped_counts(result.dump_counts())
+        merged.merge_dumped_counts(result.dump_counts())
+        merged.merge_dumped_counts(result.dump_counts(), -1)
+        expected = {
+            (str(enums.SentenceType.DECLARATIVE),): 2,
+            (str(enums.SentenceType.DECLARATIVE), str(enums.SentenceType.IMPERATIVE)): 4,
+        }
+        self.assertEqual(merged.type_counts, expected)
+
+    def test_sentence_writer_skips_duplicates(self):
+        Sentence.objects.create(
+            text='It is a human toe.',
+            genre=enums.Genre.HORROR,
+            sentence_context=enums.SentenceContext.DESCRIPTION,
+            sentence_type=enums.SentenceType.DECLARATIVE
+        )
+        writer = sp.SentenceWriter(batch_size=2)
+        for text in ['It is a human toe.', 'The cow jumped over the moon.', 'The cow jumped over the moon.']:
+            writer.add(text, enums.Genre.HORROR, enums.SentenceContext.DESCRIPTION, enums.SentenceType.DECLARATIVE)
+        writer.flush()
+        result = sorted(Sentence.objects.values_list('text', flat=True))
+        expected = ['It is a human toe.', 'The cow jumped over the moon.']
+        self.assertEqual(result, expected)
+
+    def test_stage_timer(self):
+        timer = StageTimer()
+        timer.enter('parse')
+        words = list(timer.iterate('split', 'a b c'.split()))
+        total = timer.call('join', ''.join, words)
+        timer.exit()
+        self.assertEqual(total, 'abc')
+        self.assertEqual(timer.items, {'split': 3, 'join': 1})
+        self.assertEqual(set(timer.seconds), {'parse', 'split', 'join'})
+        merged = StageTimer()
+        merged.merge(timer)
+        merged.merge(timer)
+        self.assertEqual(merged.as_dict()['split']['items'], 6)
+
+    def test_unpack_counts_updates_rows(self):
+        sp.unpack_counts(self.type_counts, self.context_counts, 4, enums.Genre.HORROR)
+        sp.unpack_counts({(enums.SentenceType.DECLARATIVE,): 3}, self.context_counts, 8, enums.Genre.HORROR)
+        result = list(TypeUnigramKeyValue.objects.values_list('gram_1', 'probability'))
+        expected = [(str(enums.SentenceType.DECLARATIVE), 0.5)]
+        self.assertEqual(result, expected)
+        self.assertFalse(TypeBigramKeyValue.objects.exists())
+
+    def test_store_ngram_counts(self):
+        sp.store_ngram_counts(self.context_counts, enums.NGramKind.CONTEXT, enums.Genre.HORROR)
+        sp.store_ngram_counts({(enums.SentenceContext.DIRECTION,): -2}, enums.NGramKind.CONTEXT, enums.Genre.HORROR)
+        result = sp.load_ngram_counts(enums.NGramKind.CONTEXT, enums.Genre.HORROR)
+        expected = {(str(enums.SentenceContext.DIRECTION), str(enums.SentenceContext.DIALOGUE)): 4}
+        self.assertEqual(result, expected)
+
+    def test_store_sentence_references(self):
+        writer = sp.SentenceWriter()
+        shared, single = [
+            writer.add(text, enums.Genre.HORROR, enums.SentenceContext.DESCRIPTION, enums.SentenceType.DECLARATIVE)
+            for text in ['It is a human toe.', 'The cow jumped over the moon.']
+        ]
+        writer.flush()
+        sp.store_sentence_references({shared: 2, single: 1}, enums.Genre.HORROR)
+        sp.store_sentence_references({shared: -1, single: -1}, enums.Genre.HORROR)
+        result = list(Sentence.objects.values_list('text', 'references'))
+        self.assertEqual(result, [('It is a human toe.', 1)])
+
+    def test_store_start_counts(self):
+        start_counts = {(enums.SentenceContext.DIALOGUE, enums.SentenceType.DECLARATIVE): 2}
+        sp.store_start_counts(start_counts, enums.Genre.HORROR)
+        sp.store_start_counts(start_counts, enums.Genre.HORROR)
+        sp.store_start_counts(start_counts, enums.Genre.ACTION)
+        result = StartSymbol.objects.get(
+            genre=enums.Genre.HORROR,
+            sentence_context=enums.SentenceContext.DIALOGUE,
+            sentence_type=enums.SentenceType.DECLARATIVE
+        ).count
+        self.assertEqual(result, 4)
+        withdrawn_counts = {(enums.SentenceContext.DIALOGUE, enums.SentenceType.DECLARATIVE): -2}
+        sp.store_start_counts(withdrawn_counts, enums.Genre.ACTION)
+        self.assertFalse(StartSymbol.objects.filter(genre=enums.Genre.ACTION).exists())
@@ -1,167 +1,144 @@
-from random import choice
+from random import Random
 import sys
 
-from nltk.metrics.distance import edit_distance
-
-from pocketmovie.enums import SentenceContext
-from reader.models import Sentence, StartSymbol
-from writer.sentence_generation_model import SentenceGenerationRNN
-import writer.models as w_models
+from pocketmovie.enums import MatchingMode, SentenceContext
+from writer.sentence_generation_model import load_sentence_generation_rnn
+from writer.sentence_pool import load_sentence_pool, ScoringPool, SentenceCandidates
+from writer.transition_tables import CONTEXT_MODELS, load_start_samplers, NGramTransitions, SequencePlanner, TYPE_MODELS
 
 
 class DoubleMarkov:
     # Limit for input size of neural language model
     RNN_INPUT_CEILING = 100
 
-    # Initialize context/type ngrams relevant to genre
-    def __init__(self, genre, title, author, characters, start_sentence, length):
+    # Initialize context/type ngrams, sentence pool and guide model for genre
+    def __init__(self, genre, title, author, characters, start_sentence, length, seed=None, shortlist_size=None,
+                 scoring_workers=1, matching_mode=MatchingMode.BIT_PARALLEL, carry_rnn_state=False, backend=None):
+        self.genre = genre
+        self.random = Random(seed)
         self.title = title.strip().upper()
         self.author = author.strip()
         self.characters = [character.strip().upper() for character in characters]
         self.start_sentence = start_sentence + ' '
-        self.current_context_ngram = ()
-        self.current_type_ngram = ()
-        self.context_unigrams = w_models.ContextUnigramKeyValue.objects.filter(genre=genre)
-        self.context_bigrams = w_models.ContextBigramKeyValue.objects.filter(genre=genre)
-        self.context_trigrams = w_models.ContextTrigramKeyValue.objects.filter(genre=genre)
-        self.type_unigrams = w_models.TypeUnigramKeyValue.objects.filter(genre=genre)
-        self.type_bigrams = w_models.TypeBigramKeyValue.objects.filter(genre=genre)
-        self.type_trigrams = w_models.TypeTrigramKeyValue.objects.filter(genre=genre)
-        self.sentences = Sentence.objects.filter(genre=genre)
-        self.rnn = SentenceGenerationRNN()
+        self.context_transitions = NGramTransitions(CONTEXT_MODELS, genre)
+        self.type_transitions = NGramTransitions(TYPE_MODELS, genre)
+        self.start_samplers = load_start_samplers(genre)
+        self.planner = SequencePlanner(self.context_transitions, self.type_transitions, self.start_samplers)
+        self.sentence_pool = load_sentence_pool(genre)
+        self.rnn = load_sentence_generation_rnn(backend)
         self.context_count_ceiling = length
+        # Without a shortlist size the guide sentence is compared to every candidate
+        self.shortlist_size = shortlist_size
+        self.scoring_workers = scoring_workers
+        self.scoring_pool = None
+        self.matching_mode = matching_mode
+        self.used_sentences = set()
+        # Carrying the guide model's state reads each sentence into it once instead of rereading recent text
+        self.carry_rnn_state = carry_rnn_state
+        self.rnn_state = None
+        self.unread_text = ''
 
-    # Query for sentence with corresponding context/type
-    def _get_sentence(self, all_text, current_context, current_type, current_character):
-        matching_sentences = self.sentences.filter(
-            sentence_context=current_context,
-            sentence_type=current_type
-        ).values_list(
-            'text',
-            flat=True
-        ).distinct()
+    # Pick sentence with corresponding context/type from the genre's sentence pool, guided by recent script text
+    def _get_sentence(self, recent_text, current_context, current_type, current_character):
+        matching_sentences = self.sentence_pool.matching(current_context, current_type)
         if matching_sentences:
-            current_text = self._match_sentence_to_guide(all_text, matching_sentences)
+            current_text = self._match_sentence_to_guide(recent_text, matching_sentences)
             if current_context == str(SentenceContext.DIALOGUE) and current_text:
-                next_character = choice(self.characters)
+                next_character = self.random.choice(self.characters)
                 while not len(self.characters) <= 1 and next_character == current_character:
-                    next_character = choice(self.characters)
+                    next_character = self.random.choice(self.characters)
                 current_character = next_character
                 current_text = '\n\n{0}:\n\t"{1}"\n\n'.format(current_character, current_text)
             return current_text + ' ', current_character
         return '', current_character
 
-    @staticmethod
-    # Convert start symbol counts to probabilities for scalability, return chosen type
-    def _get_start_type(context):
-        start_symbols = StartSymbol.objects.filter(sentence_context=context)
-        total = sum([start.count for start in start_symbols])
-        type_list = []
-        for start in start_symbols:
-            type_list += [start.sentence_type] * int((start.count / total) * 100)
-        return choice(type_list)
+    # Guide sentence from the neural model, reading only the script text added since the last guide when its state
+    # is carried across sentences
+    def _guide_text(self, recent_text):
+        if not self.carry_rnn_state:
+            return self.rnn.generate_text(recent_text[-self.RNN_INPUT_CEILING:])
+        guide_text, self.rnn_state = self.rnn.continue_text(self.unread_text, self.rnn_state)
+        self.unread_text = ''
+        return guide_text
 
-    # Identify sentence with lowest edit distance to guide sentence from neural model
-    def _match_sentence_to_guide(self, all_text, matching_sentences):
-        inference_text = all_text[-self.RNN_INPUT_CEILING:] if len(all_text) > self.RNN_INPUT_CEILING else all_text
-        guide_text = self.rnn.generate_text(inference_text)
-        current_text = ''
-        current_distance = 0
-        for sentence_text in matching_sentences:
-            if sentence_text not in all_text:
-                new_distance = edit_distance(guide_text, sentence_text)
-                if not current_text or new_distance < current_distance:
-                    current_text = sentence_text
-                    current_distance = new_distance
+    # Identify unused sentence with lowest edit distance to guide sentence from neural model, first in pool order on
+    # ties, and mark it used
+    def _match_sentence_to_guide(self, recent_text, matching_sentences):
+        guide_text = self._guide_text(recent_text)
+        if not isinstance(matching_sentences, SentenceCandidates):
+            matching_sentences = SentenceCandidates(matching_sentences)
+        if self.shortlist_size:
+            matching_sentences = matching_sentences.shortlist(guide_text, self.shortlist_size, self.used_sentences)
+        if self.matching_mode == MatchingMode.LENGTH_BUCKETS:
+            current_text = matching_sentences.length_buckets().closest(guide_text, self.used_sentences)
+        else:
+            current_text = matching_sentences.closest(guide_text, self.used_sentences, self.scoring_pool)
+        if current_text:
+            self.used_sentences.add(current_text)
         return current_text.strip()
 
-    # Retrieve usable sentences for script from database
-    def _produce_sentences(self, all_contexts):
-        payload = self.start_sentence
+    # Yield the start sentence, then a usable sentence for each planned context and type as soon as it is chosen
+    def _iter_sentences(self, plan, show_progress=True):
+        yield self.start_sentence
+        recent_text = self.start_sentence
+        self.rnn_state = None
+        self.unread_text = self.start_sentence
+        self.used_sentences = {self.start_sentence.strip()}
         current_character = ''
-        # Iterate through available context sequence and generate types considering identical subsequent contexts
-        for index, context in enumerate(all_contexts):
-            # Print progress bar to console
-            sys.stdout.write('\r')
-            complete = (index + 1) / self.context_count_ceiling
-            sys.stdout.write('Generating script: [%-50s] %.1f%%' % ('=' * int(50 * complete), 100 * complete))
-            if complete == 1:
-                sys.stdout.write('\n')
-            sys.stdout.flush()
-            try:
-                if index == 0 or context != all_contexts[index - 1]:
-                    self.current_type_ngram = (self._get_start_type(context),)
-                elif len(self.current_type_ngram) == 1:
-                    target_type = self._weighted_random(self.type_bigrams.filter(
-                        gram_1=self.current_type_ngram[0]
-                    ))
-                    self.current_type_ngram = (target_type.gram_1, target_type.gram_2)
-                elif len(self.current_type_ngram) == 2:
-                    target_type = self._weighted_random(self.type_trigrams.filter(
-                        gram_1=self.current_type_ngram[0],
-                        gram_2=self.current_type_ngram[1]
-                    ))
-                    self.current_type_ngram = (target_type.gram_1, target_type.gram_2, target_type.gram_3)
-                elif len(self.current_type_ngram) == 3:
-                    target_type = self._weighted_random(self.type_trigrams.filter(
-                        gram_1=self.current_type_ngram[1],
-                        gram_2=self.current_type_ngram[2]
-                    ))
-                    self.current_type_ngram = (target_type.gram_1, target_type.gram_2, target_type.gram_3)
-                else:
-                    target_type = self._weighted_random(self.type_unigrams)
-                    self.current_type_ngram = (target_type.gram_1,)
-            except IndexError:
-                target_type = self._weighted_random(self.type_unigrams)
-                self.current_type_ngram = (target_type.gram_1,)
+        for index, (context, sentence_type) in enumerate(plan):
+            if show_progress:
+                # Print progress bar to console
+                sys.stdout.write('\r')
+                complete = (index + 1) / self.context_count_ceiling
+                sys.stdout.write('Generating script: [%-50s] %.1f%%' % ('=' * int(50 * complete), 100 * complete))
+                if complete == 1:
+                    sys.stdout.write('\n')
+                sys.stdout.flush()
             next_sentence, current_character = self._get_sentence(
-                payload,
+                recent_text,
                 context,
-                self.current_type_ngram[-1],
+                sentence_type,
                 current_character
             )
-            payload += next_sentence
-        return payload
+            yield next_sentence
+            recent_text = (recent_text + next_sentence)[-self.RNN_INPUT_CEILING:]
+            if self.carry_rnn_state:
+                self.unread_text += next_sentence
+
+    # Plan a type for each context, generating types considering identical subsequent contexts
+    def _plan_types(self, all_contexts):
+        return list(zip(all_contexts, self.planner.plan_types(all_contexts, self.random)))
+
+    # Retrieve usable sentences for script from database
+    def _produce_sentences(self, all_contexts):
+        return ''.join(self._iter_sentences(self._plan_types(all_contexts)))
+
+    # Used as a context manager, stop scoring worker processes on leaving it
+    def __enter__(self):
+        return self
 
-    @staticmethod
-    # Produce context/type by ngram probabilities
-    def _weighted_random(l):
-        weighted_list = []
-        for item in l:
-            weighted_list += [item] * int(item.probability * 1000)
-        return choice(weighted_list)
+    def __exit__(self, *exc_info):
+        self.close()
+
+    # Stop scoring worker processes, if any
+    def close(self):
+        if self.scoring_pool:
+            self.scoring_pool.close()
+            self.scoring_pool = None
 
     # Draft movie script based on Markov chain probability
     def generate_output(self):
-        full_context_sequence = []
-        while len(full_context_sequence) < self.context_count_ceiling:
-            try:
-                if len(self.current_context_ngram) == 1:
-                    target_context = self._weighted_random(self.context_bigrams.filter(
-                        gram_1=self.current_context_ngram[0]
-                    ))
-                    self.current_context_ngram = (target_context.gram_1, target_context.gram_2)
-                elif len(self.current_context_ngram) == 2:
-                    target_context = self._weighted_random(self.context_trigrams.filter(
-                        gram_1=self.current_context_ngram[0],
-                        gram_2=self.current_context_ngram[1]
-                    ))
-                    self.current_context_ngram = (target_context.gram_1, target_context.gram_2, target_context.gram_3)
-                elif len(self.current_context_ngram) == 3:
-                    target_context = self._weighted_random(self.context_trigrams.filter(
-                        gram_1=self.current_context_ngram[1],
-                        gram_2=self.current_context_ngram[2]
-                    ))
-                    self.current_context_ngram = (target_context.gram_1, target_context.gram_2, target_context.gram_3)
-                else:
-                    target_context = self._weighted_random(self.context_unigrams)
-                    self.current_context_ngram = (target_context.gram_1,)
-            except IndexError:
-                target_context = self._weighted_random(self.context_unigrams)
-                self.current_context_ngram = (target_context.gram_1,)
-            full_context_sequence.append(self.current_context_ngram[-1])
-        return '{0}\n\nby: {1}\n\n\n\n\n\n-- Fade in from black --\n\n\n{2}\n\n\n-- End scene --\n'.format(
-            self.title,
-            self.author,
-            self._produce_sentences(full_context_sequence)
-        )
+        return ''.join(self.stream_output(show_progress=True))
+
+    # Yield the script in pieces as it is drafted: title block, each sentence or dialogue block, then closing line,
+    # running scoring workers only while the script is being drafted
+    def stream_output(self, show_progress=False):
+        yield '{0}\n\nby: {1}\n\n\n\n\n\n-- Fade in from black --\n\n\n'.format(self.title, self.author)
+        all_contexts = self.planner.plan_contexts(self.context_count_ceiling, self.random)
+        if self.scoring_workers > 1 and not self.scoring_pool:
+            self.scoring_pool = ScoringPool(self.scoring_workers)
+        try:
+            yield from self._iter_sentences(self._plan_types(all_contexts), show_progress)
+        finally:
+            self.close()
+        yield '\n\n\n-- End scene --\n'
@@ -0,0 +1,145 @@
+import numpy as np
+
+
+WORD_BITS = 64
+ONE = np.uint64(1)
+ALL_BITS = np.uint64((1 << WORD_BITS) - 1)
+HIGH_BIT = np.uint64(1 << (WORD_BITS - 1))
+
+
+# Positions of texts from longest to shortest, in text order among equal lengths
+def length_order(texts):
+    return np.argsort(-np.array([len(text) for text in texts], dtype=np.int64), kind='stable')
+
+
+class LengthBuckets:
+    # Candidate texts grouped by length as rows of character codes, so exact matching can rule out whole buckets
+    # by their length difference from the guide
+    def __init__(self, texts):
+        self.texts = tuple(texts)
+        self.characters = {character: code for code, character in enumerate(sorted(set(''.join(self.texts))))}
+        grouped = dict()
+        for position, text in enumerate(self.texts):
+            grouped.setdefault(len(text), []).append(position)
+        self.buckets = {
+            length: (
+                np.array(positions, dtype=np.int64),
+                np.array([[self.characters[character] for character in self.texts[position]] for position in positions],
+                         dtype=np.int32).reshape(len(positions), length)
+            )
+            for length, positions in grouped.items()
+        }
+
+    # Edit distances from guide codes to rows of codes that are at most limit, and limit + 1 for the rest, by a DP
+    # kept to the diagonal band within limit, dropping rows as soon as their whole DP row exceeds limit
+    @staticmethod
+    def _bounded_distances(guide_codes, codes, limit):
+        rows, length = codes.shape
+        cap = limit + 1
+        distances = np.full(rows, cap, dtype=np.int64)
+        alive = np.arange(rows)
+        previous = np.tile(np.minimum(np.arange(length + 1), cap), (rows, 1))
+        for index, guide_code in enumerate(guide_codes, 1):
+            current = np.full((len(alive), length + 1), cap, dtype=np.int64)
+            current[:, 0] = min(index, cap)
+            start, stop = max(1, index - limit), min(length, index + limit)
+            if start <= stop:
+                columns = np.arange(start - 1, stop + 1)
+                substituted = previous[:, start - 1:stop] + (codes[alive, start - 1:stop] != guide_code)
+                steps = np.minimum(previous[:, start:stop + 1] + 1, substituted)
+                # Insertions along the row, as a running minimum of distances less their column
+                shifted = np.concatenate([current[:, start - 1:start], steps], axis=1) - columns
+                current[:, start - 1:stop + 1] = np.minimum(np.minimum.accumulate(shifted, axis=1) + columns, cap)
+            # A DP row is a lower bound on the final distance
+            within = current.min(axis=1) <= limit
+            alive, previous = alive[within], current[within]
+            if not len(alive):
+                return distances
+        distances[alive] = previous[:, length]
+        return distances
+
+    # First candidate nearest to guide text by edit distance that is not among used sentences, or '' if none,
+    # visiting buckets outward from the guide length and stopping once the length difference alone exceeds the best
+    def closest(self, guide_text, used_sentences):
+        guide_codes = [self.characters.get(character, -1) for character in guide_text]
+        best_distance = None
+        best_position = None
+        for length in sorted(self.buckets, key=lambda length: (abs(length - len(guide_text)), length)):
+            if best_distance is not None and abs(length - len(guide_text)) > best_distance:
+                break
+            positions, codes = self.buckets[length]
+            usable = np.array([self.texts[position] not in used_sentences for position in positions], dtype=bool)
+            limit = max(length, len(guide_text)) if best_distance is None else best_distance
+            distances = self._bounded_distances(guide_codes, codes[usable], limit)
+            for distance, position in zip(distances, positions[usable]):
+                if distance > limit:
+                    continue
+                if best_distance is None or (distance, position) < (best_distance, best_position):
+                    best_distance, best_position = int(distance), int(position)
+        return '' if best_position is None else self.texts[best_position]
+
+
+class DistanceScorer:
+    # Candidate texts as columns of character codes, longest first, so the candidates still being read at any
+    # character position are a prefix of every length ordered slice
+    def __init__(self, texts):
+        self.texts = tuple(texts)
+        self.characters = {character: code for code, character in enumerate(sorted(set(''.join(self.texts))))}
+        self.order = length_order(self.texts)
+        self.lengths = np.array([len(self.texts[index]) for index in self.order], dtype=np.int64)
+        self.codes = np.zeros((int(self.lengths.max(initial=0)), len(self.texts)), dtype=np.int32)
+        for column, index in enumerate(self.order):
+            self.codes[:self.lengths[column], column] = [self.characters[character] for character in self.texts[index]]
+
+    # Bit masks of the guide positions holding each candidate character, one 64 bit word per block of the guide
+    def _match_masks(self, guide_text, blocks):
+        masks = np.zeros((len(self.characters), blocks), dtype=np.uint64)
+        for position, character in enumerate(guide_text):
+            if character in self.characters:
+                masks[self.characters[character], position // WORD_BITS] |= ONE << np.uint64(position % WORD_BITS)
+        return masks
+
+    # Edit distances from guide text to every candidate, in candidate order
+    def distances(self, guide_text):
+        distances = np.empty(len(self.texts), dtype=np.int64)
+        distances[self.order] = self.sorted_distances(guide_text)
+        return distances
+
+    # Edit distances from guide text to every step-th candidate in length order from start, computed for all of
+    # them at once by Myers' bit-parallel algorithm in Hyyro's block form
+    def sorted_distances(self, guide_text, start=0, step=1):
+        columns = np.arange(start, len(self.texts), step)
+        lengths = self.lengths[columns]
+        if not guide_text or not len(columns):
+            return lengths + len(guide_text)
+        distances = np.full(len(columns), len(guide_text), dtype=np.int64)
+        blocks = (len(guide_text) - 1) // WORD_BITS + 1
+        masks = self._match_masks(guide_text, blocks)
+        last_bit = np.uint64(1 << ((len(guide_text) - 1) % WORD_BITS))
+        positive = np.full((blocks, len(columns)), ALL_BITS, dtype=np.uint64)
+        negative = np.zeros((blocks, len(columns)), dtype=np.uint64)
+        # Number of candidates still being read at each character position
+        active = np.searchsorted(-lengths, -np.arange(1, lengths[0] + 1), side='right')
+        for position, count in enumerate(active):
+            codes = self.codes[position, columns[:count]]
+            # Distances along the top row of the matrix rise by one per character
+            carry_in = np.ones(count, dtype=np.int64)
+            for block in range(blocks):
+                pv = positive[block, :count]
+                mv = negative[block, :count]
+                eq = masks[codes, block]
+                carry_negative = (carry_in < 0).astype(np.uint64)
+                xv = eq | mv
+                eq |= carry_negative
+                xh = (((eq & pv) + pv) ^ pv) | eq
+                ph = mv | ~(xh | pv)
+                mh = pv & xh
+                high_bit = last_bit if block == blocks - 1 else HIGH_BIT
+                carry_out = ((ph & high_bit) != 0).astype(np.int64) - ((mh & high_bit) != 0)
+                ph = (ph << ONE) | (carry_in > 0).astype(np.uint64)
+                mh = (mh << ONE) | carry_negative
+                positive[block, :count] = mh | ~(xv | ph)
+                negative[block, :count] = ph & xv
+                carry_in = carry_out
+            distances[:count] += carry_in
+        return distances
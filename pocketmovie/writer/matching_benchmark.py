@@ -0,0 +1,184 @@
+import json
+from random import Random
+import time
+
+from nltk.metrics.distance import edit_distance
+
+from pocketmovie.enums import MatchingMode
+from writer.sentence_pool import load_sentence_pool, ScoringPool
+
+
+SHORTLIST_SIZES = (50, 200, 800)
+# Share of guide characters rewritten to imitate the drift of a neural guide sentence
+GUIDE_NOISE = 0.3
+GUIDE_ALPHABET = 'abcdefghijklmnopqrstuvwxyz     .,'
+
+
+# Closest candidate to guide text by edit distance, first found on ties, with its distance
+def closest_sentence(guide_text, candidates):
+    current_text = ''
+    current_distance = 0
+    for sentence_text in candidates:
+        new_distance = edit_distance(guide_text, sentence_text)
+        if not current_text or new_distance < current_distance:
+            current_text = sentence_text
+            current_distance = new_distance
+    return current_text, current_distance
+
+
+# Guide text made from a candidate with a share of its characters replaced, inserted or deleted at random
+def noisy_guide(text, rng, noise=GUIDE_NOISE):
+    characters = []
+    for character in text:
+        roll = rng.random()
+        if roll < noise / 3:
+            characters.append(rng.choice(GUIDE_ALPHABET))
+        elif roll < 2 * noise / 3:
+            characters += [character, rng.choice(GUIDE_ALPHABET)]
+        elif roll >= noise:
+            characters.append(character)
+    return ''.join(characters)
+
+
+# Time branch and bound matching over length buckets against the bit-parallel scorer on the context/type partitions
+# of genre, checking that both pick the same sentence
+def benchmark_exact_modes(genre, trials=50, seed=0, path=None):
+    rng = Random(seed)
+    partitions = sorted(load_sentence_pool(genre).candidates.values(), key=len, reverse=True)
+    started = time.perf_counter()
+    for candidates in partitions:
+        candidates.scorer()
+        candidates.length_buckets()
+    build_seconds = time.perf_counter() - started
+    sentences = [text for candidates in partitions for text in candidates]
+    results = {mode: {'seconds': 0, 'same_sentence': 0} for mode in MatchingMode}
+    for trial in range(trials):
+        candidates = partitions[trial % len(partitions)]
+        guide_text = noisy_guide(rng.choice(sentences), rng)
+        started = time.perf_counter()
+        text = candidates.closest(guide_text, set())
+        results[MatchingMode.BIT_PARALLEL]['seconds'] += time.perf_counter() - started
+        started = time.perf_counter()
+        results[MatchingMode.LENGTH_BUCKETS]['same_sentence'] += candidates.length_buckets().closest(
+            guide_text,
+            set()
+        ) == text
+        results[MatchingMode.LENGTH_BUCKETS]['seconds'] += time.perf_counter() - started
+    results[MatchingMode.BIT_PARALLEL]['same_sentence'] = trials
+    summary = {
+        'genre': str(genre),
+        'trials': trials,
+        'partition_sizes': [len(candidates) for candidates in partitions],
+        'build_ms': round(1000 * build_seconds, 3),
+        'modes': [
+            {
+                'mode': mode.value,
+                'ms_per_match': round(1000 * result['seconds'] / trials, 3),
+                'same_sentence_rate': round(result['same_sentence'] / trials, 3),
+            }
+            for mode, result in results.items()
+        ],
+    }
+    if path:
+        with open(path, 'w') as f:
+            json.dump(summary, f, indent=2)
+    return summary
+
+
+# Time the bit-parallel scorer, alone and across a pool of workers, against the edit distance loop on the largest
+# context/type partition of genre, checking that both pick the same sentence
+def benchmark_scoring(genre, trials=5, workers=1, seed=0, path=None):
+    rng = Random(seed)
+    candidates = max(load_sentence_pool(genre).candidates.values(), key=len)
+    started = time.perf_counter()
+    candidates.scorer()
+    build_seconds = time.perf_counter() - started
+    scoring_pool = ScoringPool(workers) if workers > 1 else None
+    loop_seconds = 0
+    scorer_seconds = 0
+    same_sentence = 0
+    try:
+        if scoring_pool:
+            # Let each worker load the pool and build its scorer before timing
+            candidates.closest('', set(), scoring_pool)
+        for _ in range(trials):
+            guide_text = noisy_guide(rng.choice(candidates), rng)
+            started = time.perf_counter()
+            text, _ = closest_sentence(guide_text, candidates)
+            loop_seconds += time.perf_counter() - started
+            started = time.perf_counter()
+            same_sentence += candidates.closest(guide_text, set(), scoring_pool) == text
+            scorer_seconds += time.perf_counter() - started
+    finally:
+        if scoring_pool:
+            scoring_pool.close()
+    summary = {
+        'genre': str(genre),
+        'trials': trials,
+        'workers': workers,
+        'candidates': len(candidates),
+        'scorer_build_ms': round(1000 * build_seconds, 3),
+        'loop_ms_per_match': round(1000 * loop_seconds / trials, 3),
+        'scorer_ms_per_match': round(1000 * scorer_seconds / trials, 3),
+        'speedup': round(loop_seconds / scorer_seconds, 2),
+        'same_sentence_rate': round(same_sentence / trials, 3),
+    }
+    if path:
+        with open(path, 'w') as f:
+            json.dump(summary, f, indent=2)
+    return summary
+
+
+# Compare shortlisted matching against exhaustive search over the context/type partitions of genre larger than
+# the smallest shortlist, guided by noisy sentences drawn from any of those partitions
+def benchmark_shortlist(genre, shortlist_sizes=SHORTLIST_SIZES, trials=50, seed=0, path=None):
+    rng = Random(seed)
+    pool = load_sentence_pool(genre)
+    partitions = sorted(pool.candidates.values(), key=len, reverse=True)
+    partitions = [candidates for candidates in partitions if len(candidates) > min(shortlist_sizes)]
+    if not partitions:
+        raise Exception('No context/type partition of {} has more than {} sentences'.format(
+            genre,
+            min(shortlist_sizes)
+        ))
+    # Build each partition's index up front so it is not charged to the first shortlist
+    started = time.perf_counter()
+    for candidates in partitions:
+        candidates.shortlist('', min(shortlist_sizes))
+    index_seconds = time.perf_counter() - started
+    sentences = [text for candidates in partitions for text in candidates]
+    exhaustive_seconds = 0
+    results = {size: {'seconds': 0, 'same_sentence': 0, 'extra_distance': 0} for size in shortlist_sizes}
+    for trial in range(trials):
+        candidates = partitions[trial % len(partitions)]
+        guide_text = noisy_guide(rng.choice(sentences), rng)
+        started = time.perf_counter()
+        best_text, best_distance = closest_sentence(guide_text, candidates)
+        exhaustive_seconds += time.perf_counter() - started
+        for size in shortlist_sizes:
+            started = time.perf_counter()
+            text, distance = closest_sentence(guide_text, candidates.shortlist(guide_text, size))
+            results[size]['seconds'] += time.perf_counter() - started
+            results[size]['same_sentence'] += text == best_text
+            results[size]['extra_distance'] += distance - best_distance
+    summary = {
+        'genre': str(genre),
+        'trials': trials,
+        'partition_sizes': [len(candidates) for candidates in partitions],
+        'index_build_ms': round(1000 * index_seconds, 3),
+        'exhaustive_ms_per_match': round(1000 * exhaustive_seconds / trials, 3),
+        'shortlists': [
+            {
+                'size': size,
+                'ms_per_match': round(1000 * result['seconds'] / trials, 3),
+                'speedup': round(exhaustive_seconds / result['seconds'], 2) if result['seconds'] else None,
+                'same_sentence_rate': round(result['same_sentence'] / trials, 3),
+                'mean_extra_distance': round(result['extra_distance'] / trials, 3),
+            }
+            for size, result in results.items()
+        ],
+    }
+    if path:
+        with open(path, 'w') as f:
+            json.dump(summary, f, indent=2)
+    return summary
@@ -0,0 +1,65 @@
+# Generated by Django 2.2.8 on 2026-10-18 12:38
+
+from django.db import migrations
+
+
+NGRAM_MODEL_GRAMS = {
+    'ContextUnigramKeyValue': ['gram_1'],
+    'ContextBigramKeyValue': ['gram_1', 'gram_2'],
+    'ContextTrigramKeyValue': ['gram_1', 'gram_2', 'gram_3'],
+    'TypeUnigramKeyValue': ['gram_1'],
+    'TypeBigramKeyValue': ['gram_1', 'gram_2'],
+    'TypeTrigramKeyValue': ['gram_1', 'gram_2', 'gram_3'],
+}
+
+
+# Keep only the most recent row for each genre and grams, as repeated rebuilds used to insert duplicates
+def remove_duplicate_ngrams(apps, schema_editor):
+    for model_name, grams in NGRAM_MODEL_GRAMS.items():
+        model = apps.get_model('writer', model_name)
+        seen = set()
+        duplicates = []
+        for row in model.objects.order_by('-id').values('id', 'genre', *grams):
+            key = tuple(row[field] for field in ['genre'] + grams)
+            if key in seen:
+                duplicates.append(row['id'])
+            else:
+                seen.add(key)
+        # Stay under SQLite's limit on query parameters
+        for start in range(0, len(duplicates), 500):
+            model.objects.filter(id__in=duplicates[start:start + 500]).delete()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('writer', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.RunPython(remove_duplicate_ngrams, migrations.RunPython.noop),
+        migrations.AlterUniqueTogether(
+            name='contextbigramkeyvalue',
+            unique_together={('genre', 'gram_1', 'gram_2')},
+        ),
+        migrations.AlterUniqueTogether(
+            name='contexttrigramkeyvalue',
+            unique_together={('genre', 'gram_1', 'gram_2', 'gram_3')},
+        ),
+        migrations.AlterUniqueTogether(
+            name='contextunigramkeyvalue',
+            unique_together={('genre', 'gram_1')},
+        ),
+        migrations.AlterUniqueTogether(
+            name='typebigramkeyvalue',
+            unique_together={('genre', 'gram_1', 'gram_2')},
+        ),
+        migrations.AlterUniqueTogether(
+            name='typetrigramkeyvalue',
+            unique_together={('genre', 'gram_1', 'gram_2', 'gram_3')},
+        ),
+        migrations.AlterUniqueTogether(
+            name='typeunigramkeyvalue',
+            unique_together={('genre', 'gram_1')},
+        ),
+    ]
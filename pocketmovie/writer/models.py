@@ -14,6 +14,11 @@ class ContextUnigramKeyValue(models.Model):
     )
     probability = models.FloatField()
 
+    class Meta:
+        unique_together = [
+            ('genre', 'gram_1')
+        ]
+
     def joined_sequence(self):
         return self.gram_1
 
@@ -33,6 +38,11 @@ class ContextBigramKeyValue(models.Model):
     )
     probability = models.FloatField()
 
+    class Meta:
+        unique_together = [
+            ('genre', 'gram_1', 'gram_2')
+        ]
+
     def joined_sequence(self):
         return self.gram_1, self.gram_2
 
@@ -56,6 +66,11 @@ class ContextTrigramKeyValue(models.Model):
     )
     probability = models.FloatField()
 
+    class Meta:
+        unique_together = [
+            ('genre', 'gram_1', 'gram_2', 'gram_3')
+        ]
+
     def joined_sequence(self):
         return self.gram_1, self.gram_2, self.gram_3
 
@@ -71,6 +86,11 @@ class TypeUnigramKeyValue(models.Model):
     )
     probability = models.FloatField()
 
+    class Meta:
+        unique_together = [
+            ('genre', 'gram_1')
+        ]
+
     def joined_sequence(self):
         return self.gram_1
 
@@ -90,6 +110,11 @@ class TypeBigramKeyValue(models.Model):
     )
     probability = models.FloatField()
 
+    class Meta:
+        unique_together = [
+            ('genre', 'gram_1', 'gram_2')
+        ]
+
     def joined_sequence(self):
         return self.gram_1, self.gram_2
 
@@ -113,5 +138,10 @@ class TypeTrigramKeyValue(models.Model):
     )
     probability = models.FloatField()
 
+    class Meta:
+        unique_together = [
+            ('genre', 'gram_1', 'gram_2', 'gram_3')
+        ]
+
     def joined_sequence(self):
         return self.gram_1, self.gram_2, self.gram_3
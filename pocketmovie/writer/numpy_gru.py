@@ -0,0 +1,133 @@
+import numpy as np
+
+from pocketmovie.enums import WeightPrecision
+
+
+# Keras activations a recurrent layer of the generation model may have been trained with
+RECURRENT_ACTIVATIONS = {
+    'hard_sigmoid': lambda x: np.clip(0.2 * x + 0.5, 0, 1),
+    'sigmoid': lambda x: 1 / (1 + np.exp(-x)),
+}
+INT8_LEVELS = 127
+
+
+class QuantizedMatrix:
+    # Rows of a vector/matrix product dequantized into one float32 block at a time
+    BLOCK_ROWS = 64
+    # Let NumPy vectors on the left of @ defer to __rmatmul__
+    __array_ufunc__ = None
+
+    # Matrix kept as float16, or as int8 with one scale per output column that is applied to the product instead
+    # of the weights. This only saves memory: every product converts the matrix back to float32 block by block, so
+    # sampling runs slower than with float32 weights, by about a third for int8 and twelve times for float16
+    def __init__(self, matrix, precision):
+        if precision == WeightPrecision.INT8:
+            scales = np.abs(matrix).max(axis=0) / INT8_LEVELS
+            scales[scales == 0] = 1
+            self.values = np.round(matrix / scales).astype(np.int8)
+            self.scales = scales.astype(np.float32)
+        else:
+            self.values = matrix.astype(np.float16)
+            self.scales = None
+        self.block = np.empty((min(self.BLOCK_ROWS, len(self.values)), self.values.shape[1]), dtype=np.float32)
+
+    def __rmatmul__(self, vector):
+        product = np.zeros(self.values.shape[1], dtype=np.float32)
+        for start in range(0, len(self.values), len(self.block)):
+            block = self.block[:len(self.values) - start]
+            np.copyto(block, self.values[start:start + len(block)], casting='unsafe')
+            product += vector[start:start + len(block)] @ block
+        return product if self.scales is None else product * self.scales
+
+    @property
+    def nbytes(self):
+        return self.values.nbytes + (self.scales.nbytes if self.scales is not None else 0)
+
+
+class NumpyGRU:
+    # Embedding, GRU and Dense weights exported from the generation model, with the embedding folded into the input
+    # half of the GRU so each character costs one recurrent product and one output product, and the recurrent and
+    # output kernels optionally quantized to precision
+    def __init__(self, weights, precision=WeightPrecision.FLOAT32):
+        self.units = weights['recurrent_kernel'].shape[0]
+        self.precision = precision
+        self.reset_after = bool(weights['reset_after'])
+        self.recurrent_activation = RECURRENT_ACTIVATIONS[str(weights['recurrent_activation'])]
+        bias = weights['bias']
+        input_bias, self.recurrent_bias = (bias[0], bias[1]) if self.reset_after else (bias, None)
+        self.input_projection = weights['embedding'] @ weights['kernel'] + input_bias
+        recurrent_kernel = weights['recurrent_kernel']
+        if self.reset_after:
+            self.recurrent_kernels = (self._stored(recurrent_kernel),)
+        else:
+            # Without reset after, the candidate's recurrent product waits on the reset gate, so its columns are split
+            self.recurrent_kernels = (
+                self._stored(recurrent_kernel[:, :2 * self.units]),
+                self._stored(recurrent_kernel[:, 2 * self.units:]),
+            )
+        self.dense_kernel = self._stored(weights['dense_kernel'])
+        self.dense_bias = weights['dense_bias']
+
+    # State after reading the character with predicted id in state
+    def _step(self, predicted_id, state):
+        projected = self.input_projection[predicted_id]
+        units = self.units
+        if self.reset_after:
+            recurrent = state @ self.recurrent_kernels[0] + self.recurrent_bias
+            update = self.recurrent_activation(projected[:units] + recurrent[:units])
+            reset = self.recurrent_activation(projected[units:2 * units] + recurrent[units:2 * units])
+            candidate = np.tanh(projected[2 * units:] + reset * recurrent[2 * units:])
+        else:
+            gate_kernel, candidate_kernel = self.recurrent_kernels
+            recurrent = state @ gate_kernel
+            update = self.recurrent_activation(projected[:units] + recurrent[:units])
+            reset = self.recurrent_activation(projected[units:2 * units] + recurrent[units:])
+            candidate = np.tanh(projected[2 * units:] + (reset * state) @ candidate_kernel)
+        return update * state + (1 - update) * candidate
+
+    def _stored(self, matrix):
+        if self.precision == WeightPrecision.FLOAT32:
+            return np.ascontiguousarray(matrix)
+        return QuantizedMatrix(matrix, self.precision)
+
+    # Logits for the next character after each of input ids
+    def logits(self, input_ids):
+        state = None
+        rows = []
+        for predicted_id in input_ids:
+            state = self.read([predicted_id], state)
+            rows.append(state @ self.dense_kernel + self.dense_bias)
+        return np.array(rows)
+
+    # Bytes held by the weights used to generate
+    @property
+    def nbytes(self):
+        arrays = (self.input_projection, self.recurrent_bias, self.dense_kernel, self.dense_bias)
+        return sum(array.nbytes for array in arrays + self.recurrent_kernels if array is not None)
+
+    # State after reading input ids on from state, or from a zero state without one
+    def read(self, input_ids, state=None):
+        if state is None:
+            state = np.zeros(self.units, dtype=self.dense_bias.dtype)
+        for predicted_id in input_ids:
+            state = self._step(predicted_id, state)
+        return state
+
+    # Ids of count characters sampled after state, each from the temperature scaled logits of the last step
+    def sample_after(self, state, count, temperature, rng=np.random):
+        predicted_ids = np.empty(count, dtype=np.int64)
+        for index in range(count):
+            if index:
+                state = self._step(predicted_ids[index - 1], state)
+            logits = (state @ self.dense_kernel + self.dense_bias) / temperature
+            probabilities = np.exp(logits - logits.max())
+            cumulative = np.cumsum(probabilities)
+            predicted_ids[index] = min(
+                int(np.searchsorted(cumulative, rng.random_sample() * cumulative[-1], side='right')),
+                len(cumulative) - 1
+            )
+        return predicted_ids
+
+    # Ids of count characters sampled after input ids
+    def sample_ids(self, input_ids, count, temperature, rng=np.random):
+        return self.sample_after(self.read(input_ids), count, temperature, rng)
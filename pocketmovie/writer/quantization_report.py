@@ -0,0 +1,87 @@
+import json
+import os
+import time
+
+import numpy as np
+
+from pocketmovie.enums import WeightPrecision
+from writer.numpy_gru import NumpyGRU
+from writer.sentence_generation_model import SentenceGenerationRNN
+
+
+PATH_TO_TEST_SCRIPTS = 'training_data/test_scripts/'
+# Memory saving precisions, whose speed and accuracy cost is measured against float32
+QUANTIZED_PRECISIONS = (WeightPrecision.INT8, WeightPrecision.FLOAT16)
+
+
+# Probabilities of the next character from rows of logits
+def _softmax(logits):
+    probabilities = np.exp(logits - logits.max(axis=1, keepdims=True))
+    return probabilities / probabilities.sum(axis=1, keepdims=True)
+
+
+# Text of every script under root, genre by genre, keeping only characters in vocab
+def _test_script_text(root, vocab):
+    texts = []
+    for genre in sorted(os.listdir(root)):
+        if not os.path.isdir(os.path.join(root, genre)) or genre.startswith('__'):
+            continue
+        for name in sorted(os.listdir(os.path.join(root, genre))):
+            with open(os.path.join(root, genre, name), encoding='utf-8') as f:
+                texts.append(f.read())
+    return ''.join(c for c in ''.join(texts) if c in vocab)
+
+
+# Compare quantized NumPy generation against float32 on the test scripts: bytes held by the weights, characters
+# sampled per second, and how far each next character distribution moves along the scripts, as mean KL divergence
+# from float32, agreement on the most likely character and bits per character
+def benchmark_quantization(precisions=QUANTIZED_PRECISIONS, weights_path=SentenceGenerationRNN.WEIGHTS_PATH,
+                           vocab_path=SentenceGenerationRNN.VOCAB_PATH, scripts_path=PATH_TO_TEST_SCRIPTS,
+                           max_chars=5000, trials=5, seed=0, path=None):
+    with open(vocab_path) as f:
+        vocab = json.load(f)
+    char_to_index = {c: i for i, c in enumerate(vocab)}
+    text = _test_script_text(scripts_path, char_to_index)[:max_chars]
+    if len(text) < 2:
+        raise Exception('Test scripts in \'{}\' hold no text in the model vocabulary'.format(scripts_path))
+    input_ids = np.array([char_to_index[c] for c in text])
+    prompt = input_ids[:SentenceGenerationRNN.INPUT_LENGTH]
+    rows = []
+    reference = None
+    for precision in (WeightPrecision.FLOAT32,) + tuple(precisions):
+        with np.load(weights_path) as weights:
+            gru = NumpyGRU(weights, precision)
+        rng = np.random.RandomState(seed)
+        gru.sample_ids(prompt, 1, SentenceGenerationRNN.TEMPERATURE, rng)
+        started = time.perf_counter()
+        for _ in range(trials):
+            gru.sample_ids(prompt, SentenceGenerationRNN.CHARS_TO_GENERATE, SentenceGenerationRNN.TEMPERATURE, rng)
+        seconds = time.perf_counter() - started
+        probabilities = _softmax(gru.logits(input_ids[:-1]).astype(np.float64))
+        if reference is None:
+            reference = probabilities
+        row = {
+            'precision': precision.value,
+            'weight_bytes': gru.nbytes,
+            'chars_per_second': round(trials * SentenceGenerationRNN.CHARS_TO_GENERATE / seconds, 1),
+            'bits_per_char': round(float(-np.log2(probabilities[np.arange(len(text) - 1), input_ids[1:]]).mean()), 4),
+            'mean_kl_divergence': round(float(
+                (reference * (np.log(reference) - np.log(probabilities))).sum(axis=1).mean()
+            ), 6),
+            'top_choice_agreement': round(float(
+                (reference.argmax(axis=1) == probabilities.argmax(axis=1)).mean()
+            ), 4),
+        }
+        rows.append(row)
+    for row in rows:
+        row['memory_saved'] = round(1 - row['weight_bytes'] / rows[0]['weight_bytes'], 4)
+        row['speedup'] = round(row['chars_per_second'] / rows[0]['chars_per_second'], 2)
+    summary = {
+        'characters': len(text),
+        'trials': trials,
+        'precisions': rows,
+    }
+    if path:
+        with open(path, 'w') as f:
+            json.dump(summary, f, indent=2)
+    return summary
@@ -1,10 +1,16 @@
+import json
 import os
+import time
 
 import numpy as np
-import tensorflow as tf
 
+from pocketmovie.enums import GenerationBackend, WeightPrecision
+from writer.numpy_gru import NumpyGRU
 
-tf.compat.v1.enable_eager_execution()
+
+# Generation models in this process by backend and precision
+_rnns = dict()
+tf = None
 
 
 class SentenceGenerationRNN:
@@ -19,14 +25,23 @@ class SentenceGenerationRNN:
     PATH_TO_TRAINING_SCRIPT = 'training_data/raw_text_scripts/all_scripts_continuous.txt'
     RNN_UNITS = 1024
     TEMPERATURE = 1.0
+    VOCAB_PATH = os.path.join(CHECKPOINT_DIR, 'vocab.json')
+    WEIGHTS_PATH = os.path.join(CHECKPOINT_DIR, 'weights.npz')
 
-    def __init__(self):
-        # Spin up neural language generation model
-        self.model = self._initialize_model()
-        # Read in continuous text file of all scripts
-        self.training_text = self._get_script_text()
+    def __init__(self, backend=None, precision=WeightPrecision.FLOAT32):
+        # Exported weights let inference run without importing TensorFlow
+        if backend is None:
+            backend = GenerationBackend.NUMPY if os.path.exists(self.WEIGHTS_PATH) else GenerationBackend.TENSORFLOW
+        self.backend = backend
+        # Precision the NumPy backend stores its recurrent and output kernels in, below float32 trading speed for memory
+        self.precision = precision
+        # Weights, compiled sampler and training text are loaded on first use
+        self._model = None
+        self._numpy_gru = None
+        self._sample_ids = None
+        self._training_text = None
         # Determine language vocabulary
-        self.vocab = sorted(set(self.training_text))
+        self.vocab = self._load_vocab()
         # Map characters to integers in order to generate vectors
         self.char_to_index, self.index_to_char = self._map_chars(self.vocab)
 
@@ -46,19 +61,92 @@ class SentenceGenerationRNN:
             tf.keras.layers.Dense(vocab_size)
         ])
 
+    # Graph that reads the prompt through the GRU cell on from an explicit state, then samples each character from
+    # the logits of the last step only and feeds it back, never leaving the graph between characters, returning the
+    # sampled ids with the state after the prompt
+    def _compile_sampler(self, model):
+        embedding, gru, dense = model.layers
+
+        @tf.function(input_signature=[
+            tf.TensorSpec([None], tf.int32),
+            tf.TensorSpec([1, self.RNN_UNITS], tf.float32),
+            tf.TensorSpec([], tf.float32),
+        ])
+        def sample_ids(input_ids, state, temperature):
+            inputs = embedding(input_ids)
+            # Outputs of the prompt are never sampled from, only its final state
+            for index in tf.range(tf.shape(input_ids)[0]):
+                _, states = gru.cell(inputs[index:index + 1], [state])
+                state = states[0]
+            prompt_state = state
+            predicted_ids = tf.TensorArray(tf.int32, size=self.CHARS_TO_GENERATE)
+            for index in tf.range(self.CHARS_TO_GENERATE):
+                logits = dense(state) / temperature
+                predicted_id = tf.cast(tf.random.categorical(logits, num_samples=1)[0, 0], tf.int32)
+                predicted_ids = predicted_ids.write(index, predicted_id)
+                _, states = gru.cell(embedding(tf.reshape(predicted_id, [1])), [state])
+                state = states[0]
+            return predicted_ids.stack(), prompt_state
+
+        return sample_ids
+
+    # Original eager loop calling the stateful model once per character, kept to compare against
+    def _generate_text_eagerly(self, start_string):
+        _import_tensorflow()
+        input_vector = [self.char_to_index[c] for c in start_string]
+        input_vector = tf.expand_dims(input_vector, 0)
+        payload = ''
+        self.model.reset_states()
+        for _ in range(self.CHARS_TO_GENERATE):
+            predictions = self.model(input_vector)
+            predictions = tf.squeeze(predictions, 0) / self.TEMPERATURE
+            predicted_id = tf.random.categorical(predictions, num_samples=1)[-1, 0].numpy()
+            input_vector = tf.expand_dims([predicted_id], 0)
+            payload += self.index_to_char[predicted_id]
+        return payload.strip()
+
+    def _generate_text_with(self, backend, new_text, state=None):
+        input_ids = [self.char_to_index[c] for c in new_text]
+        if backend == GenerationBackend.NUMPY:
+            state = self.numpy_gru.read(input_ids, state)
+            predicted_ids = self.numpy_gru.sample_after(state, self.CHARS_TO_GENERATE, self.TEMPERATURE)
+            return ''.join(self.index_to_char[predicted_ids]).strip(), state
+        if not self.model:
+            raise Exception('Checkpoint for restoring model does not exist in \'{}\''.format(
+                self.CHECKPOINT_DIR
+            ))
+        if state is None:
+            state = tf.zeros([1, self.RNN_UNITS])
+        predicted_ids, state = self.sample_ids(
+            tf.constant(input_ids, dtype=tf.int32),
+            state,
+            tf.constant(self.TEMPERATURE)
+        )
+        return ''.join(self.index_to_char[predicted_ids.numpy()]).strip(), state
+
     def _get_script_text(self):
         return open(self.PATH_TO_TRAINING_SCRIPT, 'rb').read().decode(encoding='utf-8')
 
     def _initialize_model(self):
+        _import_tensorflow()
         last_checkpoint = tf.train.latest_checkpoint(self.CHECKPOINT_DIR)
         if not last_checkpoint:
             return None
-        vocab = sorted(set(self._get_script_text()))
-        model = self._build_model(len(vocab), 1)
+        model = self._build_model(len(self.vocab), 1)
         model.load_weights(last_checkpoint).expect_partial()
         model.build(tf.TensorShape([1, None]))
         return model
 
+    # Vocabulary saved beside the checkpoints, or derived from the training text and saved when it has not been, so
+    # the training text is read at most once and never kept in memory for inference
+    def _load_vocab(self):
+        if os.path.exists(self.VOCAB_PATH):
+            with open(self.VOCAB_PATH) as f:
+                return json.load(f)
+        vocab = sorted(set(self._get_script_text()))
+        self._save_vocab(vocab)
+        return vocab
+
     @staticmethod
     def _loss(labels, logits):
         return tf.keras.losses.sparse_categorical_crossentropy(labels, logits, from_logits=True)
@@ -67,11 +155,51 @@ class SentenceGenerationRNN:
     def _map_chars(vocab):
         return {u: i for i, u in enumerate(vocab)}, np.array(vocab)
 
+    def _save_vocab(self, vocab):
+        os.makedirs(os.path.dirname(self.VOCAB_PATH), exist_ok=True)
+        with open(self.VOCAB_PATH, 'w') as f:
+            json.dump(vocab, f)
+
     @staticmethod
     def _split_input_target(sequence):
         return sequence[:-1], sequence[1:]
 
+    @property
+    def model(self):
+        if self._model is None:
+            self._model = self._initialize_model()
+        return self._model
+
+    @property
+    def numpy_gru(self):
+        if self._numpy_gru is None:
+            if not os.path.exists(self.WEIGHTS_PATH):
+                raise Exception('Exported weights for NumPy generation do not exist at \'{}\''.format(
+                    self.WEIGHTS_PATH
+                ))
+            with np.load(self.WEIGHTS_PATH) as weights:
+                self._numpy_gru = NumpyGRU(weights, self.precision)
+        return self._numpy_gru
+
+    # Sampling loop compiled once for prompts of any length
+    @property
+    def sample_ids(self):
+        if self._sample_ids is None:
+            self._sample_ids = self._compile_sampler(self.model)
+        return self._sample_ids
+
+    # Continuous text file of all scripts, only needed to train
+    @property
+    def training_text(self):
+        if self._training_text is None:
+            self._training_text = self._get_script_text()
+        return self._training_text
+
     def train_rnn(self):
+        # Exported weights would otherwise keep generating in place of the retrained model
+        if os.path.exists(self.WEIGHTS_PATH):
+            raise Exception('Exported weights exist. Remove \'{}\' if you wish to retrain'.format(self.WEIGHTS_PATH))
+        _import_tensorflow()
         last_checkpoint = tf.train.latest_checkpoint(self.CHECKPOINT_DIR)
         if last_checkpoint:
             raise Exception('Training checkpoints exist. Clear \'{}\' if you wish to retrain'.format(
@@ -97,20 +225,75 @@ class SentenceGenerationRNN:
         )
         # Execute training
         model.fit(dataset, epochs=self.EPOCHS, callbacks=[checkpoint_callback])
+        # Store vocabulary so inference never has to read the training text
+        self._save_vocab(self.vocab)
 
-    def generate_text(self, start_string):
+    # Guide text sampled once new text is read on from state, the model state after all text read before, or from
+    # scratch without one, with the state after new text so the next call only needs the text added since
+    def continue_text(self, new_text, state=None):
+        return self._generate_text_with(self.backend, new_text, state)
+
+    # Characters per second generated from start string by the eager loop, the compiled sampler and, once weights
+    # are exported, the NumPy GRU
+    def compare_generation_speed(self, start_string, trials=5):
+        generators = [
+            ('eager', self._generate_text_eagerly),
+            ('compiled', lambda text: self._generate_text_with(GenerationBackend.TENSORFLOW, text)),
+        ]
+        if os.path.exists(self.WEIGHTS_PATH):
+            generators.append(('numpy', lambda text: self._generate_text_with(GenerationBackend.NUMPY, text)))
+        rates = dict()
+        for name, generate in generators:
+            # Leave compilation and weight loading out of the timing
+            generate(start_string)
+            started = time.perf_counter()
+            for _ in range(trials):
+                generate(start_string)
+            rates[name] = round(trials * self.CHARS_TO_GENERATE / (time.perf_counter() - started), 1)
+        return rates
+
+    # Write the checkpoint's weights, with the GRU settings they depend on, to a NumPy file inference can load
+    # without TensorFlow
+    def export_weights(self):
         if not self.model:
             raise Exception('Checkpoint for restoring model does not exist in \'{}\''.format(
                 self.CHECKPOINT_DIR
             ))
-        input_vector = [self.char_to_index[c] for c in start_string]
-        input_vector = tf.expand_dims(input_vector, 0)
-        payload = ''
-        self.model.reset_states()
-        for _ in range(self.CHARS_TO_GENERATE):
-            predictions = self.model(input_vector)
-            predictions = tf.squeeze(predictions, 0) / self.TEMPERATURE
-            predicted_id = tf.random.categorical(predictions, num_samples=1)[-1, 0].numpy()
-            input_vector = tf.expand_dims([predicted_id], 0)
-            payload += self.index_to_char[predicted_id]
-        return payload.strip()
+        embedding, gru, dense = self.model.layers
+        kernel, recurrent_kernel, bias = gru.get_weights()
+        dense_kernel, dense_bias = dense.get_weights()
+        np.savez(
+            self.WEIGHTS_PATH,
+            embedding=embedding.get_weights()[0],
+            kernel=kernel,
+            recurrent_kernel=recurrent_kernel,
+            bias=bias,
+            dense_kernel=dense_kernel,
+            dense_bias=dense_bias,
+            reset_after=np.array(gru.reset_after),
+            recurrent_activation=np.array(tf.keras.activations.serialize(gru.recurrent_activation)),
+        )
+        self._numpy_gru = None
+
+    def generate_text(self, start_string):
+        return self.continue_text(start_string)[0]
+
+
+# TensorFlow is only imported once training or the TensorFlow backend needs it
+def _import_tensorflow():
+    global tf
+    if tf is None:
+        import tensorflow
+        tensorflow.compat.v1.enable_eager_execution()
+        tf = tensorflow
+    return tf
+
+
+# Generation model with backend and precision shared across the process, so weights are loaded once however many
+# scripts are written. Quantized precisions only save memory and generate more slowly than float32
+def load_sentence_generation_rnn(backend=None, precision=WeightPrecision.FLOAT32):
+    key = (str(backend) if backend else None, str(precision))
+    if key not in _rnns:
+        _rnns[key] = SentenceGenerationRNN(backend, precision)
+    return _rnns[key]
+
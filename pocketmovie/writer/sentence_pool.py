@@ -0,0 +1,159 @@
+import multiprocessing
+
+from django.db import connections
+from django.db.models import Count, Max
+import numpy as np
+
+from reader.models import Sentence
+from writer.edit_distance import DistanceScorer, length_order, LengthBuckets
+
+
+# Sentence pools per genre in this process, with the sentence table signature they were built from
+_sentence_pools = dict()
+
+
+class SentenceCandidates(tuple):
+    # Sentence texts sharing a context and type, with a character ngram index built on first shortlist
+    NGRAM_LENGTH = 3
+
+    # Candidates stored under key (genre, context, type) in a pool loaded at signature can be scored by a ScoringPool
+    def __new__(cls, texts=(), key=None, signature=None):
+        candidates = super().__new__(cls, texts)
+        candidates.key = key
+        candidates.signature = signature
+        return candidates
+
+    # Distinct padded, lowercased character ngrams of text
+    @classmethod
+    def char_ngrams(cls, text):
+        padded = ' {} '.format(text.lower())
+        return {padded[index:index + cls.NGRAM_LENGTH] for index in range(len(padded) - cls.NGRAM_LENGTH + 1)}
+
+    # Map each character ngram to the positions of candidates containing it, and each candidate to its position
+    def _build_index(self):
+        postings = dict()
+        self.positions = dict()
+        self.ngram_totals = np.zeros(len(self), dtype=np.int32)
+        for position, text in enumerate(self):
+            self.positions[text] = position
+            ngrams = self.char_ngrams(text)
+            self.ngram_totals[position] = len(ngrams)
+            for ngram in ngrams:
+                postings.setdefault(ngram, []).append(position)
+        self.postings = {ngram: np.array(positions, dtype=np.int32) for ngram, positions in postings.items()}
+
+    # Up to size candidates sharing the most character ngrams with guide text by Dice coefficient, in pool order,
+    # ranking used sentences below every unused one so they only fill a shortlist that unused candidates cannot
+    def shortlist(self, guide_text, size, used_sentences=()):
+        if len(self) <= size:
+            return self
+        if not hasattr(self, 'postings'):
+            self._build_index()
+        guide_ngrams = self.char_ngrams(guide_text)
+        shared = np.zeros(len(self), dtype=np.int32)
+        for ngram in guide_ngrams:
+            if ngram in self.postings:
+                shared[self.postings[ngram]] += 1
+        scores = shared / (self.ngram_totals + len(guide_ngrams))
+        used_positions = [self.positions[text] for text in used_sentences if text in self.positions]
+        scores[used_positions] = -1
+        return SentenceCandidates(self[position] for position in np.sort(np.argpartition(-scores, size - 1)[:size]))
+
+    # First candidate nearest to guide text by edit distance that is not among used sentences, or '' if none
+    def closest(self, guide_text, used_sentences, scoring_pool=None):
+        if scoring_pool and self.key:
+            distances = scoring_pool.distances(self, guide_text)
+        else:
+            distances = self.scorer().distances(guide_text)
+        for position in np.argsort(distances, kind='stable'):
+            if self[position] not in used_sentences:
+                return self[position]
+        return ''
+
+    # Candidates grouped by length for branch and bound matching, built on first use
+    def length_buckets(self):
+        if not hasattr(self, '_length_buckets'):
+            self._length_buckets = LengthBuckets(self)
+        return self._length_buckets
+
+    # Candidate positions from longest to shortest, the order scoring workers slice, computed on first use
+    def length_order(self):
+        if not hasattr(self, '_length_order'):
+            self._length_order = length_order(self)
+        return self._length_order
+
+    # Exact edit distance scorer over the candidates, built on first use
+    def scorer(self):
+        if not hasattr(self, '_scorer'):
+            self._scorer = DistanceScorer(self)
+        return self._scorer
+
+
+class SentencePool:
+    # Deduplicated sentence texts of one genre partitioned by context and type, in insertion order, loaded when the
+    # sentence table had signature
+    def __init__(self, rows, genre=None, signature=None):
+        self.signature = signature
+        grouped = dict()
+        for sentence_context, sentence_type, text in rows:
+            grouped.setdefault((sentence_context, sentence_type), dict())[text] = None
+        self.candidates = {
+            key: SentenceCandidates(texts, (genre,) + key if genre else None, signature)
+            for key, texts in grouped.items()
+        }
+
+    # Sentence texts with context and type, empty if there are none
+    def matching(self, sentence_context, sentence_type):
+        return self.candidates.get((str(sentence_context), str(sentence_type)), SentenceCandidates())
+
+
+class ScoringPool:
+    # Worker processes scoring stored candidates in interleaved slices of their length order, each worker
+    # loading the sentence pool itself so candidates never cross process boundaries
+    def __init__(self, workers):
+        self.workers = workers
+        # Forked workers must not share the parent's database connection
+        connections.close_all()
+        self.pool = multiprocessing.Pool(workers)
+
+    def close(self):
+        self.pool.close()
+        self.pool.join()
+
+    # Edit distances from guide text to stored candidates, in candidate order
+    def distances(self, candidates, guide_text):
+        batches = self.pool.starmap(_score_batch, [
+            (candidates.key, candidates.signature, guide_text, start, self.workers) for start in range(self.workers)
+        ])
+        distances = np.empty(len(candidates), dtype=np.int64)
+        order = candidates.length_order()
+        for start, batch in enumerate(batches):
+            distances[order[start::self.workers]] = batch
+        return distances
+
+
+# Score one slice of stored candidates in a ScoringPool worker, querying the sentence table only when the worker has
+# not yet loaded the pool at signature the candidates came from
+def _score_batch(key, signature, guide_text, start, step):
+    genre, sentence_context, sentence_type = key
+    cached = _sentence_pools.get(genre)
+    pool = cached[1] if cached and cached[0] == signature else load_sentence_pool(genre)
+    if pool.signature != signature:
+        raise Exception('Sentence pool for {} changed while it was being scored'.format(genre))
+    return pool.matching(sentence_context, sentence_type).scorer().sorted_distances(guide_text, start, step)
+
+
+# Sentence pool for genre, rebuilt only when the genre's sentence rows have changed
+def load_sentence_pool(genre):
+    sentences = Sentence.objects.filter(genre=genre)
+    signature = sentences.aggregate(rows=Count('pk'), last=Max('pk'))
+    cached = _sentence_pools.get(str(genre))
+    if cached and cached[0] == signature:
+        return cached[1]
+    pool = SentencePool(
+        sentences.order_by('pk').values_list('sentence_context', 'sentence_type', 'text'),
+        str(genre),
+        signature
+    )
+    _sentence_pools[str(genre)] = (signature, pool)
+    return pool
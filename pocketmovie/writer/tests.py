@@ -1,16 +1,39 @@
+import os
+from random import Random
+import tempfile
+
 from django.test import TestCase
+from nltk.metrics.distance import edit_distance
 import numpy as np
 
 from pocketmovie import enums
 from reader.models import Sentence, StartSymbol
 from writer.double_markov_chain import DoubleMarkov
+from writer.edit_distance import DistanceScorer, LengthBuckets
 from writer.models import ContextUnigramKeyValue, TypeUnigramKeyValue
-from writer.sentence_generation_model import SentenceGenerationRNN
+from writer.numpy_gru import NumpyGRU, QuantizedMatrix
+from writer.quantization_report import benchmark_quantization
+from writer.sentence_generation_model import load_sentence_generation_rnn, SentenceGenerationRNN
+from writer.sentence_pool import _score_batch, load_sentence_pool, SentenceCandidates, SentencePool
+from writer.transition_tables import (
+    AliasSampler,
+    CONTEXT_MODELS,
+    load_start_samplers,
+    NGramTransitions,
+    SequencePlanner,
+    TransitionMatrix,
+    TransitionTable,
+)
 
 
 class WriterTest(TestCase):
     def setUp(self):
         super().setUp()
+        # Keep vocabularies derived from the training text out of the checkpoint directory
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.addCleanup(setattr, SentenceGenerationRNN, 'VOCAB_PATH', SentenceGenerationRNN.VOCAB_PATH)
+        SentenceGenerationRNN.VOCAB_PATH = os.path.join(directory.name, 'vocab.json')
         Sentence.objects.get_or_create(
             text='Death goes by many names.',
             genre=enums.Genre.HORROR,
@@ -18,6 +41,7 @@ class WriterTest(TestCase):
             sentence_type=enums.SentenceType.DECLARATIVE,
         )
         StartSymbol.objects.get_or_create(
+            genre=enums.Genre.HORROR,
             sentence_context=enums.SentenceContext.DIALOGUE,
             sentence_type=enums.SentenceType.DECLARATIVE,
             count=1,
@@ -49,6 +73,114 @@ class WriterTest(TestCase):
         expected = ({'a': 0, 'b': 1, 'c': 2}, np.array(vocab).tolist())
         self.assertEqual(result, expected)
 
+    def test_load_vocab_saved(self):
+        self.assertIsNone(self.rnn._training_text)
+        self.assertEqual(self.rnn._load_vocab(), self.rnn.vocab)
+        with tempfile.TemporaryDirectory() as directory:
+            self.rnn.VOCAB_PATH = os.path.join(directory, 'vocab.json')
+            self.rnn._save_vocab(['a', 'b', 'c'])
+            result = self.rnn._load_vocab()
+        self.assertEqual(result, ['a', 'b', 'c'])
+        self.assertIs(self.markov.rnn, load_sentence_generation_rnn())
+
+    def test_load_sentence_generation_rnn_precision(self):
+        rnn = load_sentence_generation_rnn(precision=enums.WeightPrecision.INT8)
+        self.assertIs(load_sentence_generation_rnn(precision=enums.WeightPrecision.INT8), rnn)
+        self.assertIsNot(load_sentence_generation_rnn(), rnn)
+        self.assertEqual(rnn.precision, enums.WeightPrecision.INT8)
+        markov = DoubleMarkov(
+            enums.Genre.HORROR,
+            'Big Scary',
+            'Unit Test',
+            ['Gunther'],
+            'It was a dark and stormy night.',
+            1,
+            backend=enums.GenerationBackend.NUMPY
+        )
+        self.assertIs(markov.rnn, load_sentence_generation_rnn(enums.GenerationBackend.NUMPY))
+
+    def test_train_rnn_exported_weights(self):
+        with tempfile.TemporaryDirectory() as directory:
+            self.rnn.WEIGHTS_PATH = os.path.join(directory, 'weights.npz')
+            np.savez(self.rnn.WEIGHTS_PATH)
+            with self.assertRaisesRegex(Exception, 'Exported weights exist'):
+                self.rnn.train_rnn()
+
+    def test_numpy_gru_sample_ids(self):
+        rng = np.random.RandomState(0)
+        for reset_after in (False, True):
+            weights = {
+                'embedding': rng.randn(4, 3),
+                'kernel': rng.randn(3, 6),
+                'recurrent_kernel': rng.randn(2, 6),
+                'bias': rng.randn(2, 6) if reset_after else rng.randn(6),
+                'dense_kernel': rng.randn(2, 4),
+                'dense_bias': np.array([0, 0, 100, 0]),
+                'reset_after': np.array(reset_after),
+                'recurrent_activation': np.array('hard_sigmoid'),
+            }
+            with tempfile.TemporaryDirectory() as directory:
+                np.savez(os.path.join(directory, 'weights.npz'), **weights)
+                with np.load(os.path.join(directory, 'weights.npz')) as saved:
+                    gru = NumpyGRU(saved)
+            result = gru.sample_ids([1, 3, 0], 5, 1.0, rng).tolist()
+            self.assertEqual(result, [2, 2, 2, 2, 2])
+
+    def test_numpy_gru_read_incremental(self):
+        rng = np.random.RandomState(0)
+        gru = NumpyGRU({
+            'embedding': rng.randn(4, 3),
+            'kernel': rng.randn(3, 6),
+            'recurrent_kernel': rng.randn(2, 6),
+            'bias': rng.randn(6),
+            'dense_kernel': rng.randn(2, 4),
+            'dense_bias': rng.randn(4),
+            'reset_after': np.array(False),
+            'recurrent_activation': np.array('hard_sigmoid'),
+        })
+        np.testing.assert_allclose(gru.read([2, 0], gru.read([1, 3])), gru.read([1, 3, 2, 0]))
+        result = gru.sample_ids([1, 3], 6, 1.0, np.random.RandomState(5))
+        expected = gru.sample_after(gru.read([1, 3]), 6, 1.0, np.random.RandomState(5))
+        self.assertEqual(result.tolist(), expected.tolist())
+
+    def test_quantized_matrix(self):
+        rng = np.random.RandomState(0)
+        matrix = rng.randn(100, 7).astype(np.float32)
+        vector = rng.randn(100).astype(np.float32)
+        for precision, tolerance in ((enums.WeightPrecision.INT8, 0.05), (enums.WeightPrecision.FLOAT16, 0.005)):
+            result = vector @ QuantizedMatrix(matrix, precision)
+            np.testing.assert_allclose(result, vector @ matrix, rtol=tolerance, atol=tolerance)
+
+    def test_benchmark_quantization(self):
+        rng = np.random.RandomState(0)
+        with tempfile.TemporaryDirectory() as directory:
+            np.savez(
+                os.path.join(directory, 'weights.npz'),
+                embedding=rng.randn(3, 4),
+                kernel=rng.randn(4, 6),
+                recurrent_kernel=rng.randn(2, 6),
+                bias=rng.randn(6),
+                dense_kernel=rng.randn(2, 3),
+                dense_bias=rng.randn(3),
+                reset_after=np.array(False),
+                recurrent_activation=np.array('hard_sigmoid'),
+            )
+            with open(os.path.join(directory, 'vocab.json'), 'w') as f:
+                f.write('["a", "b", "c"]')
+            os.mkdir(os.path.join(directory, 'horror'))
+            with open(os.path.join(directory, 'horror', 'Script.txt'), 'w') as f:
+                f.write('abc cab bca')
+            result = benchmark_quantization(
+                weights_path=os.path.join(directory, 'weights.npz'),
+                vocab_path=os.path.join(directory, 'vocab.json'),
+                scripts_path=directory,
+                trials=1,
+            )
+        self.assertEqual(result['characters'], 9)
+        self.assertEqual([row['precision'] for row in result['precisions']], ['float32', 'int8', 'float16'])
+        self.assertEqual(result['precisions'][0]['mean_kl_divergence'], 0)
+        self.assertLess(result['precisions'][1]['weight_bytes'], result['precisions'][0]['weight_bytes'])
+
     def test_split_input_target(self):
         sequence = ['a', 'b', 'c', 'd', 'e']
         result = self.rnn._split_input_target(sequence)
@@ -65,10 +197,96 @@ class WriterTest(TestCase):
         expected = ('\n\nGUNTHER:\n\t"Death goes by many names."\n\n ', 'GUNTHER')
         self.assertEqual(result, expected)
 
-    def test_get_start_type(self):
-        result = self.markov._get_start_type(enums.SentenceContext.DIALOGUE)
-        expected = str(enums.SentenceType.DECLARATIVE)
+    def test_plan_start_type(self):
+        result = self.markov.planner.plan_types([str(enums.SentenceContext.DIALOGUE)], Random())
+        expected = [str(enums.SentenceType.DECLARATIVE)]
+        self.assertEqual(result, expected)
+
+    def test_distance_scorer(self):
+        texts = ['kitten', '', 'sitting', 'a' * 70, 'kitchen']
+        guide_text = 'sitting in the kitchen ' * 4
+        scorer = DistanceScorer(texts)
+        result = scorer.distances(guide_text).tolist()
+        expected = [edit_distance(guide_text, text) for text in texts]
+        self.assertEqual(result, expected)
+
+    def test_sentence_candidates_closest(self):
+        candidates = SentenceCandidates(['Run.', 'Fun.', 'Sun.', 'Nobody leaves.'])
+        self.assertEqual(candidates.closest('Gun.', set()), 'Run.')
+        self.assertEqual(candidates.closest('Gun.', {'Run.', 'Fun.'}), 'Sun.')
+        self.assertEqual(candidates.closest('Gun.', set(candidates)), '')
+
+    def test_length_buckets_closest(self):
+        buckets = LengthBuckets(['Run.', 'Fun.', 'Sun.', 'Nobody leaves.', 'Gunshots.'])
+        self.assertEqual(buckets.closest('Gun.', set()), 'Run.')
+        self.assertEqual(buckets.closest('Gun.', {'Run.', 'Fun.', 'Sun.'}), 'Gunshots.')
+        self.assertEqual(buckets.closest('', set(buckets.texts)), '')
+
+    def test_get_sentence_no_queries(self):
+        with self.assertNumQueries(0):
+            self.markov._get_sentence('', str(enums.SentenceContext.DIALOGUE), enums.SentenceType.DECLARATIVE, '')
+
+    def test_sentence_pool_matching(self):
+        pool = SentencePool([('C', 'T', 'One.'), ('C', 'T', 'Two.'), ('C', 'T', 'One.'), ('C', 'U', 'Three.')])
+        self.assertEqual(pool.matching('C', 'T'), ('One.', 'Two.'))
+        self.assertEqual(pool.matching('D', 'T'), ())
+
+    def test_sentence_candidates_shortlist(self):
+        candidates = SentenceCandidates(['The door creaks open.', 'Run!', 'The door slams shut.', 'Who is there?'])
+        result = candidates.shortlist('the door creaks', 2)
+        expected = ('The door creaks open.', 'The door slams shut.')
+        self.assertEqual(result, expected)
+        self.assertIs(candidates.shortlist('the door creaks', 4), candidates)
+        result = candidates.shortlist('the door creaks', 1, {'The door creaks open.'})
+        self.assertEqual(result, ('The door slams shut.',))
+
+    def test_load_sentence_pool_invalidated(self):
+        pool = load_sentence_pool(enums.Genre.HORROR)
+        self.assertIs(load_sentence_pool(enums.Genre.HORROR), pool)
+        Sentence.objects.create(
+            text='Nobody leaves.',
+            genre=enums.Genre.HORROR,
+            sentence_context=enums.SentenceContext.DIALOGUE,
+            sentence_type=enums.SentenceType.DECLARATIVE,
+        )
+        result = load_sentence_pool(enums.Genre.HORROR).matching(
+            enums.SentenceContext.DIALOGUE,
+            enums.SentenceType.DECLARATIVE
+        )
+        expected = ('Death goes by many names.', 'Nobody leaves.')
+        self.assertEqual(result, expected)
+
+    def test_score_batch_cached_pool(self):
+        pool = load_sentence_pool(enums.Genre.HORROR)
+        candidates = pool.matching(enums.SentenceContext.DIALOGUE, enums.SentenceType.DECLARATIVE)
+        self.assertEqual(list(candidates.length_order()), list(candidates.scorer().order))
+        with self.assertNumQueries(0):
+            result = _score_batch(candidates.key, candidates.signature, 'Death goes', 0, 1)
+        expected = candidates.scorer().sorted_distances('Death goes', 0, 1)
+        self.assertEqual(list(result), list(expected))
+
+    def test_plan_no_queries(self):
+        with self.assertNumQueries(0):
+            contexts = self.markov.planner.plan_contexts(3, Random())
+            self.markov.planner.plan_types(contexts, Random())
+
+    def test_load_start_samplers_invalidated(self):
+        samplers = load_start_samplers(enums.Genre.HORROR)
+        self.assertIs(load_start_samplers(enums.Genre.HORROR), samplers)
+        StartSymbol.objects.create(
+            genre=enums.Genre.HORROR,
+            sentence_context=enums.SentenceContext.DESCRIPTION,
+            sentence_type=enums.SentenceType.DECLARATIVE,
+            count=2,
+        )
+        result = set(load_start_samplers(enums.Genre.HORROR))
+        expected = {str(enums.SentenceContext.DIALOGUE), str(enums.SentenceContext.DESCRIPTION)}
         self.assertEqual(result, expected)
+        # Counts moved between types leave the row count and total unchanged
+        samplers = load_start_samplers(enums.Genre.HORROR)
+        StartSymbol.objects.filter(sentence_context=enums.SentenceContext.DESCRIPTION).update(count=1)
+        StartSymbol.objects.filter(sentence_context=enums.SentenceContext.DIALOGUE).update(count=2)
+        self.assertIsNot(load_start_samplers(enums.Genre.HORROR), samplers)
 
     def test_match_sentence_to_guide(self):
         result = self.markov._match_sentence_to_guide(
@@ -83,9 +301,102 @@ class WriterTest(TestCase):
         expected = 'It was a dark and stormy night. \n\nGUNTHER:\n\t"Death goes by many names."\n\n '
         self.assertEqual(result, expected)
 
+    def test_transition_matrix_backs_off(self):
+        transitions = NGramTransitions(CONTEXT_MODELS, enums.Genre.HORROR)
+        matrix = TransitionMatrix(transitions, [(str(enums.SentenceContext.DIRECTION),)])
+        result = [matrix.states[state] for state in matrix.walk(0, [(0.5, 0.5)])]
+        expected = [(str(enums.SentenceContext.DIALOGUE),)]
+        self.assertEqual(result, expected)
+
+    def test_alias_sampler_exact(self):
+        weights = [0.5, 0.0005, 0.2, 0.2995]
+        sampler = AliasSampler('abcd', weights)
+        result = [sampler.thresholds[column] for column in range(len(weights))]
+        for column, alias in enumerate(sampler.aliases):
+            result[alias] += 1 - sampler.thresholds[column]
+        expected = [weight * len(weights) for weight in weights]
+        self.assertEqual(np.round(result, 9).tolist(), np.round(expected, 9).tolist())
+
+    def test_sequence_planner(self):
+        planner = SequencePlanner(
+            self.markov.context_transitions,
+            self.markov.type_transitions,
+            {str(enums.SentenceContext.DESCRIPTION): AliasSampler([str(enums.SentenceType.EXCLAMATORY)], [1])}
+        )
+        contexts = planner.plan_contexts(3, Random())
+        self.assertEqual(contexts, [str(enums.SentenceContext.DIALOGUE)] * 3)
+        contexts = [str(enums.SentenceContext.DESCRIPTION), str(enums.SentenceContext.DIALOGUE)]
+        result = planner.plan_types(contexts, Random())
+        expected = [str(enums.SentenceType.EXCLAMATORY), str(enums.SentenceType.DECLARATIVE)]
+        self.assertEqual(result, expected)
+
+    def test_transition_matrix_walk(self):
+        table = TransitionTable([('a', 'b', 0.5), ('a', 'c', 0.0005), ('b', 'c', 1), ('c', 'a', 0)])
+        self.assertEqual(table.samplers[('a',)].outcomes, (('a', 'b'), ('a', 'c')))
+
+        class Transitions:
+            def sampler_for(self, current):
+                if current[-1:] not in table.samplers:
+                    raise IndexError('No ngram follows {}'.format(current))
+                return table.samplers[current[-1:]]
+
+        matrix = TransitionMatrix(Transitions(), [('a',)])
+        self.assertEqual(matrix.rows[matrix.ids[('a', 'c')]], (0, [], [], []))
+        result = [matrix.states[state] for state in matrix.walk(0, [(0.9, 0.5), (0.5, 0.5)])]
+        self.assertEqual(result, [('a', 'b'), ('b', 'c')])
+        with self.assertRaises(IndexError):
+            matrix.walk(0, [(0.9, 0.5), (0.5, 0.5), (0.5, 0.5)])
+
+    def test_match_sentence_to_guide_length_buckets(self):
+        self.markov.matching_mode = enums.MatchingMode.LENGTH_BUCKETS
+        self.test_match_sentence_to_guide()
+
+    def test_produce_sentences_skips_used(self):
+        dialogue = str(enums.SentenceContext.DIALOGUE)
+        result = self.markov._produce_sentences([dialogue, dialogue])
+        expected = 'It was a dark and stormy night. \n\nGUNTHER:\n\t"Death goes by many names."\n\n  '
+        self.assertEqual(result, expected)
+        # Sentences used in one draft are available again to the next
+        self.assertEqual(self.markov._produce_sentences([dialogue, dialogue]), expected)
+
+    def test_produce_sentences_without_rnn_state(self):
+        dialogue = str(enums.SentenceContext.DIALOGUE)
+        self.markov._produce_sentences([dialogue, dialogue])
+        self.assertEqual(self.markov.unread_text, 'It was a dark and stormy night. ')
+
+    def test_produce_sentences_carries_rnn_state(self):
+        dialogue = str(enums.SentenceContext.DIALOGUE)
+        calls = []
+
+        def continue_text(new_text, state=None):
+            calls.append((new_text, state))
+            return 'Death goes by many names.', len(calls)
+
+        self.markov.carry_rnn_state = True
+        self.markov.rnn.continue_text = continue_text
+        try:
+            self.markov._produce_sentences([dialogue, dialogue])
+        finally:
+            del self.markov.rnn.continue_text
+        expected = [
+            ('It was a dark and stormy night. ', None),
+            ('\n\nGUNTHER:\n\t"Death goes by many names."\n\n ', 1),
+        ]
+        self.assertEqual(calls, expected)
+
     def test_generate_output(self):
         result = self.markov.generate_output()
         expected = 'BIG SCARY\n\nby: Unit Test\n\n\n\n\n\n-- Fade in from black --\n\n\n' \
                    'It was a dark and stormy night. \n\nGUNTHER:\n\t"Death goes by many names."' \
                    '\n\n \n\n\n-- End scene --\n'
         self.assertEqual(result, expected)
+
+    def test_stream_output(self):
+        result = list(self.markov.stream_output())
+        expected = [
+            'BIG SCARY\n\nby: Unit Test\n\n\n\n\n\n-- Fade in from black --\n\n\n',
+            'It was a dark and stormy night. ',
+            '\n\nGUNTHER:\n\t"Death goes by many names."\n\n ',
+            '\n\n\n-- End scene --\n',
+        ]
+        self.assertEqual(result, expected)
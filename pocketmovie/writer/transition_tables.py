@@ -0,0 +1,188 @@
+import numpy as np
+
+from reader.models import StartSymbol
+import writer.models as w_models
+
+
+GRAM_FIELDS = ('gram_1', 'gram_2', 'gram_3')
+# Unigram, bigram and trigram probability models for contexts and types
+CONTEXT_MODELS = (w_models.ContextUnigramKeyValue, w_models.ContextBigramKeyValue, w_models.ContextTrigramKeyValue)
+TYPE_MODELS = (w_models.TypeUnigramKeyValue, w_models.TypeBigramKeyValue, w_models.TypeTrigramKeyValue)
+
+# Start type samplers per genre in this process, with the start symbol signature they were built from
+_start_samplers = dict()
+
+
+class AliasSampler:
+    # Walker's alias table over outcomes in proportion to their weights, so each draw takes constant time
+    def __init__(self, outcomes, weights):
+        self.outcomes = tuple(outcomes)
+        total = sum(weights)
+        scaled = [weight * len(weights) / total for weight in weights]
+        self.thresholds = [1.0] * len(weights)
+        self.aliases = list(range(len(weights)))
+        small = [index for index, weight in enumerate(scaled) if weight < 1]
+        large = [index for index, weight in enumerate(scaled) if weight >= 1]
+        while small and large:
+            short, tall = small.pop(), large.pop()
+            self.thresholds[short] = scaled[short]
+            self.aliases[short] = tall
+            scaled[tall] -= 1 - scaled[short]
+            (small if scaled[tall] < 1 else large).append(tall)
+
+    # Pick a column uniformly, then keep it or take its alias
+    def sample(self, rng):
+        column = rng.randrange(len(self.outcomes))
+        if rng.random() < self.thresholds[column]:
+            return self.outcomes[column]
+        return self.outcomes[self.aliases[column]]
+
+
+class TransitionTable:
+    # Group ngram rows of one degree by history, with a sampler over the ngrams that can follow each history
+    def __init__(self, rows):
+        grouped = dict()
+        for row in rows:
+            grams, probability = tuple(row[:-1]), row[-1]
+            if probability > 0:
+                ngrams, probabilities = grouped.setdefault(grams[:-1], ([], []))
+                ngrams.append(grams)
+                probabilities.append(probability)
+        self.samplers = {
+            history: AliasSampler(ngrams, probabilities) for history, (ngrams, probabilities) in grouped.items()
+        }
+
+
+class NGramTransitions:
+    # Load unigram, bigram and trigram tables of genre once so a Markov walk never queries the database
+    def __init__(self, models, genre):
+        self.unigrams, self.bigrams, self.trigrams = [
+            TransitionTable(model.objects.filter(genre=genre).values_list(*GRAM_FIELDS[:degree], 'probability'))
+            for degree, model in enumerate(models, 1)
+        ]
+
+    # Sampler over the ngrams that can follow the current one, backing off to unigrams when no longer ngram follows
+    # and raising IndexError if not even a unigram can
+    def sampler_for(self, current):
+        if len(current) == 1 and current in self.bigrams.samplers:
+            return self.bigrams.samplers[current]
+        elif len(current) > 1 and current[-2:] in self.trigrams.samplers:
+            return self.trigrams.samplers[current[-2:]]
+        elif () in self.unigrams.samplers:
+            return self.unigrams.samplers[()]
+        raise IndexError('No ngram follows {}'.format(current))
+
+
+class TransitionMatrix:
+    # Every ngram state a chain can reach from its roots as an integer id, with each state's alias table over the
+    # ids of the states it moves to, so a walk only looks up numbers
+    def __init__(self, transitions, roots=((),)):
+        self.states = []
+        self.ids = dict()
+        for root in roots:
+            self.state_id(root)
+        # Plain lists read faster than arrays one item at a time
+        self.rows = []
+        # Rows add the states they lead to, so expand states until every reachable one has a row
+        while len(self.rows) < len(self.states):
+            try:
+                sampler = transitions.sampler_for(self.states[len(self.rows)])
+                outcomes, thresholds, aliases = self.row(sampler, sampler.outcomes)
+            except IndexError:
+                outcomes, thresholds, aliases = [], [], []
+            self.rows.append((len(outcomes), outcomes, thresholds, aliases))
+
+    # Alias table of sampler with its outcomes replaced by the ids of the states they lead to
+    def row(self, sampler, next_states):
+        return [self.state_id(state) for state in next_states], sampler.thresholds, sampler.aliases
+
+    def state_id(self, state):
+        if state not in self.ids:
+            self.ids[state] = len(self.states)
+            self.states.append(state)
+        return self.ids[state]
+
+    # States visited by a walk from state, drawing each step with a pair of uniform numbers from the current
+    # state's row, or from the given entry row where one is given
+    def walk(self, state, draws, entries=None):
+        rows = self.rows
+        path = []
+        for step, (column_draw, alias_draw) in enumerate(draws):
+            if entries and entries[step]:
+                outcomes, thresholds, aliases = entries[step]
+                count = len(outcomes)
+            else:
+                count, outcomes, thresholds, aliases = rows[state]
+            if not count:
+                raise IndexError('No ngram follows {}'.format(self.states[state]))
+            column = int(column_draw * count)
+            if alias_draw >= thresholds[column]:
+                column = aliases[column]
+            state = outcomes[column]
+            path.append(state)
+        return path
+
+
+class SequencePlanner:
+    # Context and type chains of a genre as transition matrices, for drawing a script's whole context and type
+    # sequences up front from pre-drawn random numbers
+    def __init__(self, context_transitions, type_transitions, start_samplers):
+        self.contexts = TransitionMatrix(context_transitions)
+        start_types = {
+            sentence_context: [(sentence_type,) for sentence_type in sampler.outcomes]
+            for sentence_context, sampler in start_samplers.items()
+        }
+        self.types = TransitionMatrix(type_transitions, [()] + sum(start_types.values(), []))
+        self.start_rows = {
+            sentence_context: self.types.row(start_samplers[sentence_context], states)
+            for sentence_context, states in start_types.items()
+        }
+
+    # Pairs of uniform numbers for the steps of a walk, seeded from rng
+    @staticmethod
+    def _draws(rng, steps):
+        return np.random.RandomState(rng.getrandbits(32)).random_sample((steps, 2)).tolist()
+
+    # Context sequence of the given length
+    def plan_contexts(self, length, rng):
+        path = self.contexts.walk(self.contexts.ids[()], self._draws(rng, length))
+        return [self.contexts.states[state][-1] for state in path]
+
+    # Type for each context, restarting the type chain from a start type whenever the context changes
+    def plan_types(self, contexts, rng):
+        draws = self._draws(rng, len(contexts))
+        starts = [index for index, context in enumerate(contexts) if index == 0 or context != contexts[index - 1]]
+        path = []
+        for start, stop in zip(starts, starts[1:] + [len(contexts)]):
+            # Contexts without start symbols take a unigram type from the empty state's row instead
+            entries = [self.start_rows.get(str(contexts[start]))] + [None] * (stop - start - 1)
+            path += self.types.walk(self.types.ids[()], draws[start:stop], entries)
+        return [self.types.states[state][-1] for state in path]
+
+
+# Forget cached start type samplers once ingestion has changed start symbol counts
+def clear_start_samplers():
+    _start_samplers.clear()
+
+
+# Start type sampler for each context of genre, rebuilt only when any start symbol count has changed
+def load_start_samplers(genre):
+    # A genre has at most one start symbol per context and type, so every count can be compared
+    signature = tuple(StartSymbol.objects.filter(genre=genre, count__gt=0).order_by(
+        'sentence_context',
+        'sentence_type'
+    ).values_list('sentence_context', 'sentence_type', 'count'))
+    cached = _start_samplers.get(str(genre))
+    if cached and cached[0] == signature:
+        return cached[1]
+    grouped = dict()
+    for sentence_context, sentence_type, count in signature:
+        sentence_types, counts = grouped.setdefault(sentence_context, ([], []))
+        sentence_types.append(sentence_type)
+        counts.append(count)
+    samplers = {
+        sentence_context: AliasSampler(sentence_types, counts)
+        for sentence_context, (sentence_types, counts) in grouped.items()
+    }
+    _start_samplers[str(genre)] = (signature, samplers)
+    return samplers